@@ -0,0 +1,28 @@
+"""embedding_storage
+
+Revision ID: 2b7e4d1c9a63
+Revises: 9f1b2c7d4e85
+Create Date: 2026-10-17 16:50:18.204417
+
+"""
+
+from collections.abc import Sequence
+
+# revision identifiers, used by Alembic.
+revision: str = "2b7e4d1c9a63"
+down_revision: str | None = "9f1b2c7d4e85"
+branch_labels: str | Sequence[str] | None = None
+depends_on: str | Sequence[str] | None = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Nothing to migrate, the revision marks where the storage became configurable. Migrations keep
+    # product_embedding.vector at vector(1536); the storage and dimension of the settings are switched to,
+    # and the embeddings backfilled, by `python -m app.embedder --convert-storage`.
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    # Nothing to undo. A switched column is converted back to vector(1536) of the earlier revisions
+    # by `python -m app.embedder --reset-storage`, run it before downgrading past this revision.
@@ -0,0 +1,39 @@
+"""embedding_vector_index
+
+Revision ID: 6a3f8c2e1b57
+Revises: 2b7e4d1c9a63
+Create Date: 2026-10-17 17:45:03.518260
+
+"""
+
+from collections.abc import Sequence
+
+import sqlalchemy as sa
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "6a3f8c2e1b57"
+down_revision: str | None = "2b7e4d1c9a63"
+branch_labels: str | Sequence[str] | None = None
+depends_on: str | Sequence[str] | None = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # vchordrq of the default settings, on the vector(1536) column; another index, or one with more lists
+    # once there are more embeddings, is built by `python -m app.db.vector_index`
+    op.execute("CREATE EXTENSION IF NOT EXISTS vchord CASCADE")
+    rows = op.get_bind().scalar(sa.text("SELECT count(*) FROM product_embedding"))
+    # spherical centroids suit the cosine distance, residual quantization only helps the L2 one
+    lists = max(1, rows // 1000)
+    options = f"residual_quantization = false\n[build.internal]\nlists = [{lists}]\nspherical_centroids = true"
+    op.execute(
+        "CREATE INDEX ix_product_embedding_vector ON product_embedding "
+        f"USING vchordrq (vector vector_cosine_ops) WITH (options = $${options}$$)"
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index("ix_product_embedding_vector", table_name="product_embedding")
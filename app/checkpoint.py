@@ -0,0 +1,73 @@
+import logging
+from datetime import UTC, datetime
+
+from sqlalchemy import desc, select, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session as SessionClass
+
+from app.config import settings
+from app.db.models import CrawlCheckpoint, CrawlKind, CrawlRun, CrawlStatus
+
+log = logging.getLogger(__name__)
+
+
+def start_run(s: SessionClass, kind: CrawlKind) -> CrawlRun:
+    """
+    Resume the last unfinished run of the kind, or start a new one.
+
+    Runs started longer than `crawl_resume_max_age` ago are abandoned, their progress is out of date.
+    """
+    run = None
+    if settings.crawl_resume:
+        run = s.scalar(
+            select(CrawlRun)
+            .where(
+                (CrawlRun.kind == kind)
+                & (CrawlRun.status == CrawlStatus.running)
+                & (CrawlRun.started_at >= datetime.now(UTC) - settings.crawl_resume_max_age)
+            )
+            .order_by(desc(CrawlRun.started_at))
+            .limit(1)
+        )
+    if run:
+        log.info("resuming %r", run)
+    else:
+        run = CrawlRun(kind=kind)
+        s.add(run)
+        s.flush()
+        log.info("starting %r", run)
+    s.commit()
+    return run
+
+
+def finish_run(s: SessionClass, run_id: int):
+    s.execute(
+        update(CrawlRun).where(CrawlRun.id == run_id).values(status=CrawlStatus.finished, finished_at=datetime.now(UTC))
+    )
+    s.commit()
+    log.info("finished crawl run %d", run_id)
+
+
+def get_progress(s: SessionClass, run_id: int) -> dict[int, CrawlCheckpoint]:
+    """Checkpoints of the run by category id."""
+    return {cp.category_id: cp for cp in s.scalars(select(CrawlCheckpoint).where(CrawlCheckpoint.run_id == run_id))}
+
+
+def save_checkpoint(s: SessionClass, run_id: int, category_id: int, last_page: int = 0, done: bool = False):
+    stmt = insert(CrawlCheckpoint).values(
+        run_id=run_id,
+        category_id=category_id,
+        last_page=last_page,
+        status=CrawlStatus.finished if done else CrawlStatus.running,
+        updated_at=datetime.now(UTC),
+    )
+    s.execute(
+        stmt.on_conflict_do_update(
+            index_elements=[CrawlCheckpoint.run_id, CrawlCheckpoint.category_id],
+            set_={
+                "last_page": stmt.excluded.last_page,
+                "status": stmt.excluded.status,
+                "updated_at": stmt.excluded.updated_at,
+            },
+        )
+    )
@@ -1,4 +1,6 @@
+from datetime import timedelta
 from pathlib import Path
+from typing import Literal
 
 from pydantic import HttpUrl, PostgresDsn
 from pydantic_settings import BaseSettings, SettingsConfigDict
@@ -13,8 +15,84 @@ class Settings(BaseSettings):
     openai_api_key: str | None
 
     # optionals
+    arbuz_site_url: HttpUrl = HttpUrl("https://arbuz.kz/")
     arbuz_api_base: HttpUrl = HttpUrl("https://arbuz.kz/api/v1/")
 
+    # cache of raw API responses: "on" revalidates cached responses, "replay" never goes to the network
+    http_cache: Literal["off", "on", "replay"] = "off"
+    http_cache_dir: Path = Path(__file__).parent.parent / ".cache" / "http"
+
+    # decode responses with orjson and validate pages of products at once, without keeping unused fields
+    fast_parse: bool = True
+
+    # resume the last unfinished crawl run instead of starting over, if it started recently enough
+    crawl_resume: bool = True
+    crawl_resume_max_age: timedelta = timedelta(days=1)
+    # sleeps of the sequential loader between requests, never done when replaying cached responses
+    crawl_pauses: bool = True
+
+    # concurrent crawler
+    crawl_rate: float = 2.0  # requests per second, shared by all workers
+    crawl_burst: int = 4
+    crawl_max_in_flight: int = 4
+    crawl_concurrency: int = 4  # categories crawled at once
+    crawl_max_retries: int = 5
+    crawl_page_size: int = 40
+    crawl_queue_size: int = 16  # pages buffered between the pipeline stages
+    crawl_parse_workers: int = 2
+    crawl_write_batch: int = 8  # pages written in one transaction
+    crawl_report_interval: float = 30  # seconds
+
+    # embedding provider: "openai", "local" (a sentence-transformers model at embedding_model_path, on the CPU,
+    # installed with the `local` extra) or "fake" (deterministic vectors of hashed words, for tests and benchmarks).
+    # embedding_dimension stays 1536 whatever the provider: a local model makes shorter vectors (384 is typical),
+    # set it to the model's dimension or the provider fails on its first use
+    embedding_provider: Literal["openai", "local", "fake"] = "openai"
+    embedding_model: str = "text-embedding-3-small"  # of the OpenAI provider
+    embedding_model_path: Path | None = None
+    # of the stored vectors, the provider's are cut to it; after changing it (or the storage)
+    # run `python -m app.embedder --convert-storage`, which converts the column and re-embeds what it can't convert
+    embedding_dimension: int = 1536
+    # "halfvec" stores vectors in half precision, halving the table and its index; compare both
+    # (and shorter dimensions) with `python -m benchmarks.vector_recall` before switching
+    embedding_storage: Literal["vector", "halfvec"] = "vector"
+
+    # embedding requests, within the limits of the OpenAI account
+    embedding_chunk_size: int = 1000  # products read from the database at once
+    embedding_batch_tokens: int = 100_000  # estimated tokens per request, the API allows 300k
+    embedding_batch_size: int = 1000  # texts per request, the API allows 2048
+    embedding_concurrency: int = 4  # requests in flight
+    embedding_rpm: int = 3000
+    embedding_tpm: int = 1_000_000
+    embedding_max_retries: int = 5
+    # vectors of search queries, kept in memory and in the query_embedding table
+    query_cache_size: int = 10_000  # queries kept in memory
+    # counters of where they came from, for the textfile collector of node_exporter (a file of its own,
+    # the search runs in another process than the loader), written at most once per interval
+    query_cache_prometheus_file: Path | None = None
+    query_cache_report_interval: float = 60  # seconds
+
+    # approximate nearest neighbour index of the embeddings, see app.db.vector_index
+    vector_index: Literal["vchordrq", "hnsw"] = "vchordrq"
+    vector_index_lists: int | None = None  # vchordrq lists, a thousandth of the rows if not set
+    vector_index_rebuild_share: float = 0.2  # of the embeddings changed by a run, to rebuild the index after it
+    vector_search_probes: int = 10  # vchordrq lists searched per query, more for better recall
+    vector_search_ef: int = 40  # hnsw candidates kept per query, more for better recall
+    # "memory" searches a copy of the embeddings in process (app.gpt.product_index) instead of Postgres
+    search_index: Literal["postgres", "memory"] = "postgres"
+    search_index_path: Path | None = None  # to keep the copy in memory-mapped files, shared by the processes
+    search_index_quantized: bool = False  # scan an int8 copy (a quarter of the size), exact re-ranking
+    search_index_refresh: float = 60  # seconds between reads of the changed embeddings and availability
+    # "hybrid" also matches queries to product names, brands and category paths with full-text search
+    # and merges both rankings with reciprocal rank fusion, so exact names aren't missed
+    search_mode: Literal["vector", "hybrid"] = "vector"
+    search_candidates: int = 20  # per query and ranking, fused into the results of the query
+    search_rrf_k: int = 60  # rank offset of the fusion, larger ones flatten the weight of the top ranks
+
+    # a JSON report of every loader run, and optionally its metrics for the textfile collector of node_exporter
+    report_dir: Path = Path(__file__).parent.parent / ".cache" / "reports"
+    report_prometheus_file: Path | None = None
+
     def api(self, path: str):
         return str(self.arbuz_api_base) + path
 
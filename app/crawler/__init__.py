@@ -0,0 +1,9 @@
+from .categories import (
+    crawl_categories as crawl_categories,
+    load_categories_concurrently as load_categories_concurrently,
+)
+from .client import ArbuzClient as ArbuzClient
+from .limiter import RateLimiter as RateLimiter
+from .pipeline import ProductPipeline as ProductPipeline
+from .prices import PricePipeline as PricePipeline, crawl_prices as crawl_prices, refresh_prices as refresh_prices
+from .products import crawl_products as crawl_products, load_products_concurrently as load_products_concurrently
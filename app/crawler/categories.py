@@ -0,0 +1,82 @@
+import asyncio
+import logging
+
+from requests import Session as HTTPSession
+
+from app.config import settings
+from app.db import Session
+from app.db.models import CrawlKind
+from app.loader import (
+    get_base_categories,
+    load_json,
+    login,
+    parse_category_info,
+    refresh_category_paths,
+    refresh_search_vectors,
+    upsert_categories,
+)
+from app.metrics import metrics, run_report
+from app.schemas.categories import CategorySchema
+
+from .client import ArbuzClient
+
+log = logging.getLogger(__name__)
+
+
+async def fetch_category_info(client: ArbuzClient, cs: CategorySchema) -> tuple[int, list[CategorySchema]] | None:
+    """Async counterpart of `app.loader.get_category_info`, returns None for a missing category."""
+    log.info("getting info for %s ", cs)
+    rs = await client.get(settings.api(f"shop/catalog/{cs.id}"), params={"limit": 0, "page": 1})
+    if rs.status_code == 404:
+        log.info("category not found: %s", cs)
+        return None
+    rs.raise_for_status()
+    return parse_category_info(load_json(rs))
+
+
+async def discover_categories(
+    client: ArbuzClient, base_css: list[CategorySchema]
+) -> tuple[dict[int, CategorySchema], dict[int, int]]:
+    """
+    Walk the category tree breadth-first, expanding every level concurrently.
+
+    Returns discovered categories by id, parents before children, and product counts by category id.
+    """
+    tree = {cs.id: cs for cs in base_css}
+    product_counts = {}
+    level = list(tree.values())
+    depth = 0
+    while level:
+        log.info("expanding %d categories at depth %d", len(level), depth)
+        infos = await asyncio.gather(*(fetch_category_info(client, cs) for cs in level))
+        next_level = []
+        for cs, info in zip(level, infos, strict=True):
+            if info is None:
+                continue
+            product_counts[cs.id], sub_css = info
+            for sub_cs in sub_css:
+                if sub_cs.id in tree:
+                    continue
+                sub_cs.parent_id = sub_cs.parent_id or cs.id
+                tree[sub_cs.id] = sub_cs
+                next_level.append(sub_cs)
+        level = next_level
+        depth += 1
+    return tree, product_counts
+
+
+async def crawl_categories(s: HTTPSession, base_css: list[CategorySchema]):
+    async with ArbuzClient.from_session(s) as client:
+        return await discover_categories(client, base_css)
+
+
+def load_categories_concurrently() -> None:
+    """Same as `app.loader.load_categories`, but the tree is discovered level by level and written at once."""
+    client = login()
+    with run_report(CrawlKind.categories):
+        base_css = list(get_base_categories().values())
+        tree, product_counts = asyncio.run(crawl_categories(client, base_css))
+        with metrics.timer("db_write_duration_seconds", op="categories"), Session() as s, s.begin():
+            upsert_categories(s, list(tree.values()), product_counts)
+            refresh_search_vectors(s, category_ids=refresh_category_paths(s))
+        log.info("%d categories loaded", len(tree))
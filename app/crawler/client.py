@@ -0,0 +1,105 @@
+import asyncio
+import logging
+import math
+import time
+
+import httpx
+from requests import Session as HTTPSession
+
+from app.config import settings
+from app.http_cache import CachingTransport, ResponseCache
+from app.metrics import endpoint, metrics
+
+from .limiter import RateLimiter
+
+log = logging.getLogger(__name__)
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+def retry_after(rs: httpx.Response) -> float | None:
+    value = rs.headers.get("Retry-After")
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        # HTTP-date form is not worth parsing here
+        return None
+
+
+class ArbuzClient:
+    """Pooled async HTTP client that sends every request through a shared rate limiter."""
+
+    def __init__(
+        self,
+        http: httpx.AsyncClient,
+        limiter: RateLimiter,
+        max_retries: int = 5,
+        backoff_factor: float = 3,
+    ):
+        self.http = http
+        self.limiter = limiter
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+
+    @classmethod
+    def from_session(cls, s: HTTPSession) -> "ArbuzClient":
+        """Reuse the cookies and headers of a session authorized by `app.loader.login`."""
+        transport = httpx.AsyncHTTPTransport(limits=httpx.Limits(max_connections=settings.crawl_max_in_flight))
+        if settings.http_cache != "off":
+            cache = ResponseCache(settings.http_cache_dir)
+            transport = CachingTransport(cache, transport, replay=settings.http_cache == "replay")
+        http = httpx.AsyncClient(
+            cookies=s.cookies,
+            headers=dict(s.headers),
+            timeout=httpx.Timeout(30),
+            transport=transport,
+        )
+        limiter = RateLimiter(
+            # replayed responses come from the disk, nothing to be polite to
+            math.inf if settings.http_cache == "replay" else settings.crawl_rate,
+            burst=settings.crawl_burst,
+            max_in_flight=settings.crawl_max_in_flight,
+        )
+        return cls(http, limiter, max_retries=settings.crawl_max_retries)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.http.aclose()
+
+    async def get(self, url: str, params: dict | None = None) -> httpx.Response:
+        """
+        GET with adaptive backoff; the last response is returned even if the retries are exhausted.
+
+        Network errors and timeouts are retried with the same backoff, and raised once the retries are exhausted.
+        """
+        for attempt in range(self.max_retries + 1):
+            try:
+                async with self.limiter:
+                    started = time.perf_counter()
+                    rs = await self.http.get(url, params=params)
+            except httpx.TransportError as e:
+                if attempt == self.max_retries:
+                    raise
+                # a blip of this connection, not the host pushing back, so the others go on at the same rate
+                delay = self.backoff_factor * 2**attempt
+                log.warning("%r from %s, retry %d in %.1fs", e, url, attempt + 1, delay)
+                metrics.inc("http_retries_total", endpoint=endpoint(url), status=type(e).__name__)
+                await asyncio.sleep(delay)
+                continue
+            labels = {"endpoint": endpoint(url), "status": str(rs.status_code)}
+            metrics.observe("http_request_duration_seconds", time.perf_counter() - started, **labels)
+            if rs.status_code not in RETRY_STATUSES:
+                self.limiter.recover()
+                return rs
+            if attempt < self.max_retries:
+                delay = retry_after(rs)
+                if delay is None:
+                    delay = self.backoff_factor * 2**attempt
+                log.warning("got %d from %s, retry %d in %.1fs", rs.status_code, url, attempt + 1, delay)
+                metrics.inc("http_retries_total", **labels)
+                self.limiter.backoff(delay)
+        return rs
@@ -0,0 +1,77 @@
+import asyncio
+import logging
+import math
+import time
+
+log = logging.getLogger(__name__)
+
+
+class RateLimiter:
+    """
+    Token bucket shared by every request to a single host.
+
+    Limits both the request rate (``rate`` tokens per second, up to ``burst`` at once)
+    and the number of requests in flight. When the host pushes back (429/5xx)
+    the rate is halved and all requests are paused for the given delay,
+    then the rate is slowly restored on successful responses.
+    An infinite rate limits the number of requests in flight only.
+    """
+
+    def __init__(self, rate: float, burst: int = 1, max_in_flight: int = 4, min_rate: float = 0.1):
+        self.max_rate = rate
+        self.min_rate = min(min_rate, rate)
+        self.rate = rate
+        self.burst = burst
+
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+        self._in_flight = asyncio.Semaphore(max_in_flight)
+
+    async def __aenter__(self):
+        await self._in_flight.acquire()
+        try:
+            await self.acquire()
+        except BaseException:
+            self._in_flight.release()
+            raise
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self._in_flight.release()
+
+    def _refill(self, now: float):
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self):
+        if math.isinf(self.rate):
+            # nothing to count, only a pause after a 429/5xx holds requests back
+            while (delay := self._paused_until - time.monotonic()) > 0:
+                await asyncio.sleep(delay)
+            return
+        # waiters queue up on the lock, so tokens are handed out in arrival order
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._refill(now)
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def backoff(self, delay: float):
+        """Slow down after the host answered with 429/5xx."""
+        self.rate = max(self.min_rate, self.rate / 2)
+        self._paused_until = max(self._paused_until, time.monotonic() + delay)
+        self._tokens = 0
+        log.warning("backing off for %.1fs, rate lowered to %.2f rps", delay, self.rate)
+
+    def recover(self):
+        """Additively restore the rate after a successful response."""
+        if self.rate < self.max_rate:
+            self.rate = min(self.max_rate, self.rate + self.max_rate / 10)
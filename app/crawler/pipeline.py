@@ -0,0 +1,272 @@
+import asyncio
+import logging
+import math
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from datetime import UTC, datetime
+
+import httpx
+from sqlalchemy import update
+
+from app.checkpoint import save_checkpoint
+from app.config import settings
+from app.db import Session
+from app.db.models import Category
+from app.loader import ImportRegistry, ImportStats, catalog_params, load_json, parse_catalog_products, upsert_products
+from app.metrics import metrics
+from app.schemas.product import ProductSchema
+
+from .client import ArbuzClient
+
+log = logging.getLogger(__name__)
+
+
+async def fetch_catalog_data(client: ArbuzClient, cat: Category, limit: int, page: int) -> dict:
+    """Async counterpart of `app.loader.get_catalog_products`, returns the raw response to be parsed later."""
+    log.info("getting %r products, page %d of size %d", cat.name, page, limit)
+    rs = await client.get(settings.api(f"shop/catalog/{cat.id}"), params=catalog_params(limit, page))
+    rs.raise_for_status()
+    return load_json(rs)
+
+
+@dataclass
+class StageStats:
+    """Throughput of a pipeline stage. A stage that is busy close to 100% of the time is the bottleneck."""
+
+    name: str
+    workers: int = 1
+    pages: int = 0
+    products: int = 0
+    busy: float = 0.0
+    started: float = field(default_factory=time.monotonic)
+
+    @contextmanager
+    def track(self):
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.busy += time.monotonic() - started
+
+    def __str__(self):
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        return (
+            f"{self.name}: {self.pages} pages ({self.pages / elapsed:.2f}/s), "
+            f"{self.products} products ({self.products / elapsed:.1f}/s), "
+            f"busy {self.busy / (elapsed * self.workers):.0%}"
+        )
+
+
+@dataclass(eq=False)
+class CategoryJob:
+    cat: Category
+    last_page: int = 0  # the last page written, without gaps before it
+    pages: int = 0  # pages sent down the pipeline
+    written: set[int] = field(default_factory=set)
+    fetched: bool = False  # set by the writer once the end-of-category marker reaches it
+    stats: ImportStats = field(default_factory=ImportStats)
+
+    @property
+    def done(self) -> bool:
+        return self.fetched and len(self.written) == self.pages
+
+    def page_written(self, number: int):
+        self.written.add(number)
+        while self.last_page + 1 in self.written:
+            self.last_page += 1
+
+
+@dataclass(eq=False)
+class Page:
+    job: CategoryJob
+    number: int | None  # None marks the end of the category
+    data: dict | None = None
+    products: list = field(default_factory=list)
+
+
+def write_pages(
+    products: list[ProductSchema], run_id: int, jobs: list[CategoryJob], registry: ImportRegistry | None
+) -> ImportStats:
+    """
+    Write products of several pages in one transaction, along with the progress of their categories.
+
+    Categories the pages complete are marked as updated.
+    """
+    with metrics.timer("db_write_duration_seconds", op="products"), Session() as s, s.begin():
+        stats, written = upsert_products(s, products, registry)
+        for job in jobs:
+            save_checkpoint(s, run_id, job.cat.id, last_page=job.last_page, done=job.done)
+        if completed := [job.cat.id for job in jobs if job.done]:
+            s.execute(update(Category).where(Category.id.in_(completed)).values(updated_at=datetime.now(UTC)))
+    if registry is not None:
+        registry.update(written)
+    return stats
+
+
+class ProductPipeline:
+    """
+    Fetch, parse and write stages of the product crawl, connected by bounded queues.
+
+    Fetching runs concurrently through the shared client, parsing and writing are
+    offloaded to threads, and the writer coalesces several pages into one transaction.
+    When a stage falls behind, the queue in front of it fills up and blocks the stages upstream.
+    """
+
+    def __init__(self, client: ArbuzClient, run_id: int, registry: ImportRegistry | None = None):
+        self.client = client
+        self.run_id = run_id
+        self.registry = registry  # only the writer touches it
+        self.limit = settings.crawl_page_size
+        self.raw: asyncio.Queue[Page | None] = asyncio.Queue(maxsize=settings.crawl_queue_size)
+        self.parsed: asyncio.Queue[Page | None] = asyncio.Queue(maxsize=settings.crawl_queue_size)
+        self.fetch_stats = StageStats("fetch", workers=settings.crawl_concurrency)
+        self.parse_stats = StageStats("parse", workers=settings.crawl_parse_workers)
+        self.write_stats = StageStats("write")
+
+    async def fetch_page(self, job: CategoryJob, number: int) -> int:
+        with self.fetch_stats.track():
+            data = await fetch_catalog_data(self.client, job.cat, self.limit, number)
+        return await self.send(job, number, data)
+
+    async def send(self, job: CategoryJob, number: int, data: dict) -> int:
+        size = len(data["data"]["products"]["data"])
+        self.fetch_stats.pages += 1
+        self.fetch_stats.products += size
+        job.pages += 1
+        await self.raw.put(Page(job, number, data=data))
+        return size
+
+    async def fetch_pages(self, job: CategoryJob, start_page: int) -> list[int]:
+        """Send pages of the category down the pipeline, return their sizes."""
+        sizes = []
+        count = job.cat.product_count
+        if count is None:
+            # the first page tells how many pages there are
+            with self.fetch_stats.track():
+                data = await fetch_catalog_data(self.client, job.cat, self.limit, page=start_page)
+            sizes.append(await self.send(job, start_page, data))
+            count = data["data"]["products"]["count"]
+        # fetch the rest of them at once, but at least one page in case the count is stale
+        first = start_page + len(sizes)
+        numbers = range(first, max(math.ceil(count / self.limit), start_page) + 1)
+        # busy for the batch as a whole, its requests overlap
+        with self.fetch_stats.track():
+            # every request settles before the pages are sent, so none of them follows a failure (or the
+            # end-of-category marker sent after it) down the pipeline
+            results = await asyncio.gather(
+                *(fetch_catalog_data(self.client, job.cat, self.limit, number) for number in numbers),
+                return_exceptions=True,
+            )
+        for number, data in zip(numbers, results, strict=True):
+            if isinstance(data, BaseException):
+                # the pages before it are sent, a 404 ends the category with them
+                raise data
+            sizes.append(await self.send(job, number, data))
+        # the count might be stale, keep going the sequential way until a page is not full
+        while sizes[-1] == self.limit:
+            sizes.append(await self.fetch_page(job, start_page + len(sizes)))
+        return sizes
+
+    async def fetch_category(self, cat: Category, start_page: int = 1):
+        log.info("importing products of %r", cat.name)
+        # pages before the start one were written by the run before it was interrupted
+        job = CategoryJob(cat, last_page=start_page - 1)
+        try:
+            await self.fetch_pages(job, start_page)
+        except httpx.HTTPStatusError as e:
+            if e.response.status_code != 404:
+                raise
+            # there are no (more) pages, the category is done with the ones sent
+            log.info("no more products found for %r", cat.name)
+        await self.raw.put(Page(job, None))
+
+    async def fetch_stage(self, cats: asyncio.Queue[tuple[Category, int]]):
+        while not cats.empty():
+            await self.fetch_category(*cats.get_nowait())
+
+    async def parse_stage(self):
+        while (page := await self.raw.get()) is not None:
+            if page.number is not None:
+                with self.parse_stats.track():
+                    page.products = await asyncio.to_thread(self.parse, page)
+                page.data = None  # let the raw payload go as soon as possible
+                self.parse_stats.pages += 1
+                self.parse_stats.products += len(page.products)
+            await self.parsed.put(page)
+
+    def parse(self, page: Page) -> list:
+        """Parse products of a page, called in a worker thread."""
+        return parse_catalog_products(page.data, page.job.cat.id, self.limit, page.number)
+
+    def write(self, products: list, jobs: list[CategoryJob]) -> ImportStats:
+        """Write products of a batch of pages, called in a worker thread."""
+        return write_pages(products, self.run_id, jobs, self.registry)
+
+    def account(self, batch: list[Page]) -> list[CategoryJob]:
+        """Account the batch in its category jobs, return the jobs."""
+        for page in batch:
+            if page.number is None:
+                page.job.fetched = True
+            else:
+                page.job.page_written(page.number)
+        return list(dict.fromkeys(page.job for page in batch))
+
+    async def write_stage(self):
+        finished = False
+        while not finished:
+            batch = [await self.parsed.get()]
+            while len(batch) < settings.crawl_write_batch and not self.parsed.empty():
+                batch.append(self.parsed.get_nowait())
+            if None in batch:
+                finished = True
+                batch = [page for page in batch if page is not None]
+            if not batch:
+                continue
+
+            jobs = self.account(batch)
+            products = [ps for page in batch for ps in page.products]
+            with self.write_stats.track():
+                stats = await asyncio.to_thread(self.write, products, jobs)
+            self.write_stats.pages += sum(page.number is not None for page in batch)
+            self.write_stats.products += len(products)
+
+            for job in jobs:
+                ids = {ps.id for page in batch if page.job is job for ps in page.products}
+                job.stats.update(
+                    ImportStats(stats.inserted & ids, stats.changed & ids, stats.unchanged & ids, stats.missing & ids)
+                )
+                if job.done:
+                    log.info("products imported for %r: %s", job.cat.name, job.stats)
+
+    def report(self):
+        for stats in (self.fetch_stats, self.parse_stats, self.write_stats):
+            log.info("%s", stats)
+
+    async def reporter(self):
+        while True:
+            await asyncio.sleep(settings.crawl_report_interval)
+            log.info("queues: raw %d, parsed %d", self.raw.qsize(), self.parsed.qsize())
+            self.report()
+
+    async def run(self, cats: list[tuple[Category, int]]):
+        """Crawl categories, each one starting from the given page."""
+        queue: asyncio.Queue[tuple[Category, int]] = asyncio.Queue()
+        for cat, start_page in cats:
+            queue.put_nowait((cat, start_page))
+
+        async with asyncio.TaskGroup() as tg:
+            reporter = tg.create_task(self.reporter())
+            writer = tg.create_task(self.write_stage())
+            parsers = [tg.create_task(self.parse_stage()) for _ in range(settings.crawl_parse_workers)]
+            fetchers = [tg.create_task(self.fetch_stage(queue)) for _ in range(settings.crawl_concurrency)]
+
+            # shut the stages down one after another, so every page makes it to the database
+            await asyncio.gather(*fetchers)
+            for _ in parsers:
+                await self.raw.put(None)
+            await asyncio.gather(*parsers)
+            await self.parsed.put(None)
+            await writer
+            reporter.cancel()
+        self.report()
@@ -0,0 +1,127 @@
+import asyncio
+import logging
+
+from requests import Session as HTTPSession
+from sqlalchemy import text
+from sqlalchemy.orm import Session as SessionClass
+
+from app.checkpoint import finish_run, save_checkpoint, start_run
+from app.db import Session
+from app.db.models import Category, CrawlKind
+from app.loader import ImportStats, login, price_hash
+from app.metrics import metrics, run_report
+from app.schemas.product import ProductPriceSchema, price_page_adapter
+
+from .client import ArbuzClient
+from .pipeline import CategoryJob, Page, ProductPipeline
+from .products import get_pending_categories
+
+log = logging.getLogger(__name__)
+
+PRICE_COLUMNS = ("id", "price_actual", "price_special", "price_previous", "is_available")
+
+
+def apply_prices(s: SessionClass, prices: list[ProductPriceSchema]) -> set[int]:
+    """
+    Bulk-load prices into a temporary table with COPY and apply them with a single UPDATE.
+
+    Only rows whose prices or availability differ are touched, their content hash is updated along
+    (see `app.loader.product_hash`). Returns ids of the updated products.
+    """
+    s.execute(
+        text(
+            "CREATE TEMP TABLE product_price_stage ("
+            "id integer PRIMARY KEY, price_actual float8, price_special integer, "
+            "price_previous varchar, is_available boolean, price_hash varchar"
+            ") ON COMMIT DROP"
+        )
+    )
+    # COPY isn't exposed by SQLAlchemy, it goes through the psycopg connection of the same transaction
+    conn = s.connection().connection.driver_connection
+    columns = ", ".join((*PRICE_COLUMNS, "price_hash"))
+    with conn.cursor() as cur, cur.copy(f"COPY product_price_stage ({columns}) FROM STDIN") as copy:
+        # a product listed in several categories of the batch is staged once
+        for ps in {ps.id: ps for ps in prices}.values():
+            copy.write_row(
+                (
+                    ps.id,
+                    ps.price_actual,
+                    ps.price_special,
+                    None if ps.price_previous is None else str(ps.price_previous),
+                    ps.is_available,
+                    price_hash(ps),
+                )
+            )
+    rows = s.execute(
+        text(
+            "UPDATE product p SET "
+            "price_actual = st.price_actual, price_special = st.price_special, "
+            "price_previous = st.price_previous, is_available = st.is_available, updated_at = now(), "
+            "content_hash = split_part(p.content_hash, ':', 1) || ':' || st.price_hash "
+            "FROM product_price_stage st "
+            "WHERE p.id = st.id AND (p.price_actual, p.price_special, p.price_previous, p.is_available) "
+            "IS DISTINCT FROM (st.price_actual, st.price_special, st.price_previous, st.is_available) "
+            "RETURNING p.id"
+        )
+    )
+    changed = set(rows.scalars())
+    metrics.inc("rows_written_total", len(changed), table="product")
+    return changed
+
+
+def missing_products(s: SessionClass) -> set[int]:
+    """Ids of the staged prices of `apply_prices` whose products aren't in the database."""
+    rows = s.execute(
+        text("SELECT st.id FROM product_price_stage st WHERE NOT EXISTS (SELECT FROM product p WHERE p.id = st.id)")
+    )
+    return set(rows.scalars())
+
+
+def write_prices(prices: list[ProductPriceSchema], run_id: int, jobs: list[CategoryJob]) -> ImportStats:
+    """Write prices of several pages in one transaction, along with the progress of their categories."""
+    with metrics.timer("db_write_duration_seconds", op="prices"), Session() as s, s.begin():
+        changed = apply_prices(s, prices)
+        missing = missing_products(s)
+        for job in jobs:
+            save_checkpoint(s, run_id, job.cat.id, last_page=job.last_page, done=job.done)
+    # left to the full product load
+    metrics.inc("products_missing_total", len(missing))
+    return ImportStats(changed=changed, unchanged={ps.id for ps in prices} - changed - missing, missing=missing)
+
+
+class PricePipeline(ProductPipeline):
+    """
+    `ProductPipeline` that refreshes prices and availability of already loaded products.
+
+    Only the volatile fields are parsed, and products unknown to the database are skipped,
+    they are left to the full product load.
+    """
+
+    def parse(self, page: Page) -> list[ProductPriceSchema]:
+        with metrics.timer("page_parse_duration_seconds"):
+            prices = price_page_adapter.validate_python(page.data["data"]["products"]["data"])
+        metrics.inc("pages_parsed_total")
+        metrics.inc("products_parsed_total", len(prices))
+        return prices
+
+    def write(self, products: list[ProductPriceSchema], jobs: list[CategoryJob]) -> ImportStats:
+        return write_prices(products, self.run_id, jobs)
+
+
+async def crawl_prices(s: HTTPSession, cats: list[tuple[Category, int]], run_id: int) -> None:
+    async with ArbuzClient.from_session(s) as client:
+        await PricePipeline(client, run_id).run(cats)
+
+
+def refresh_prices() -> None:
+    """Refresh prices and availability of products in the leaf categories, much cheaper than the full load."""
+    client = login()
+    with run_report(CrawlKind.prices) as report:
+        with Session() as s:
+            run = start_run(s, CrawlKind.prices)
+            cats = get_pending_categories(s, run.id)
+        report.info["run_id"] = run.id
+        log.info("%d categories selected for a price refresh", len(cats))
+        asyncio.run(crawl_prices(client, cats, run.id))
+        with Session() as s:
+            finish_run(s, run.id)
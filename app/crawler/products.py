@@ -0,0 +1,51 @@
+import asyncio
+import logging
+
+from requests import Session as HTTPSession
+from sqlalchemy.orm import Session as SessionClass
+
+from app.checkpoint import finish_run, get_progress, start_run
+from app.db import Session
+from app.db.models import Category, CrawlKind, CrawlStatus
+from app.loader import ImportRegistry, get_leaf_categories, login
+from app.metrics import run_report
+
+from .client import ArbuzClient
+from .pipeline import ProductPipeline
+
+log = logging.getLogger(__name__)
+
+
+async def crawl_products(
+    s: HTTPSession, cats: list[tuple[Category, int]], run_id: int, registry: ImportRegistry
+) -> None:
+    async with ArbuzClient.from_session(s) as client:
+        await ProductPipeline(client, run_id, registry).run(cats)
+
+
+def get_pending_categories(s: SessionClass, run_id: int) -> list[tuple[Category, int]]:
+    """Leaf categories the run hasn't finished yet, with the page to start from."""
+    progress = get_progress(s, run_id)
+    cats = []
+    for cat in get_leaf_categories(s):
+        cp = progress.get(cat.id)
+        if not cp:
+            cats.append((cat, 1))
+        elif cp.status != CrawlStatus.finished:
+            cats.append((cat, cp.last_page + 1))
+    return cats
+
+
+def load_products_concurrently() -> None:
+    """Same as `app.loader.load_products`, but categories and pages are fetched concurrently."""
+    client = login()
+    with run_report(CrawlKind.products) as report:
+        with Session() as s:
+            run = start_run(s, CrawlKind.products)
+            cats = get_pending_categories(s, run.id)
+            registry = ImportRegistry.for_products(s)
+        report.info["run_id"] = run.id
+        log.info("%d categories selected for an update", len(cats))
+        asyncio.run(crawl_products(client, cats, run.id, registry))
+        with Session() as s:
+            finish_run(s, run.id)
@@ -0,0 +1,58 @@
+"""
+Storage type and dimension of `ProductEmbedding.vector`.
+
+Migrations keep the column at ``vector(1536)``, `convert_column` switches it in place to the one of the settings
+(``python -m app.embedder --convert-storage``): longer vectors are cut and normalized back like
+`app.gpt.embeddings.shorten` does, shorter ones can't grow, so for a larger dimension the embeddings are deleted.
+Compare the options with `benchmarks.vector_recall` first. Before downgrading the migrations past a switch,
+convert it back with ``python -m app.embedder --reset-storage``.
+"""
+
+import logging
+import re
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session as SessionClass
+
+from .vector_index import INDEX_NAME
+
+log = logging.getLogger(__name__)
+
+# of the column the migrations create
+MIGRATED_STORAGE = "vector"
+MIGRATED_DIMENSION = 1536
+
+
+def column_type(session: SessionClass) -> tuple[str, int | None]:
+    """Storage and dimension of the column in the database, no dimension if it's unconstrained."""
+    column = session.scalar(
+        text(
+            "SELECT format_type(atttypid, atttypmod) FROM pg_attribute "
+            "WHERE attrelid = 'product_embedding'::regclass AND attname = 'vector'"
+        )
+    )
+    storage, dimension = re.fullmatch(r"(\w+)(?:\((\d+)\))?", column).groups()
+    return storage, int(dimension) if dimension else None
+
+
+def convert_column(session: SessionClass, storage: str, dimension: int) -> bool:
+    """Convert the column to the storage and dimension, False if it already is. The vector index is dropped."""
+    current_storage, current_dimension = column_type(session)
+    if (current_storage, current_dimension) == (storage, dimension):
+        return False
+    log.info("converting %s(%s) embeddings to %s(%d)", current_storage, current_dimension, storage, dimension)
+    # of the operator class of the old storage
+    session.execute(text(f"DROP INDEX IF EXISTS {INDEX_NAME}"))
+    if current_dimension is None or current_dimension < dimension:
+        deleted = session.execute(text("DELETE FROM product_embedding")).rowcount
+        log.info("%d embeddings deleted, they can't grow to %d dimensions", deleted, dimension)
+    value = "vector::vector"
+    if current_dimension and current_dimension > dimension:
+        value = f"l2_normalize(subvector(vector::vector, 1, {dimension}))"
+    session.execute(
+        text(
+            f"ALTER TABLE product_embedding ALTER COLUMN vector TYPE {storage}({dimension}) "
+            f"USING ({value})::{storage}({dimension})"
+        )
+    )
+    return True
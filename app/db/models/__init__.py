@@ -1,17 +1,24 @@
 from .base import Base
 from .category import Category
+from .crawl_run import CrawlCheckpoint, CrawlKind, CrawlRun, CrawlStatus
 from .feature import Feature
 from .product import Product
 from .product_category import ProductCategory
 from .product_embedding import ProductEmbedding
 from .product_features import product_features
+from .query_embedding import QueryEmbedding
 
 __all__ = [
     "Base",
     "Category",
+    "CrawlCheckpoint",
+    "CrawlKind",
+    "CrawlRun",
+    "CrawlStatus",
     "Feature",
     "Product",
     "ProductCategory",
     "ProductEmbedding",
     "product_features",
+    "QueryEmbedding",
 ]
@@ -19,6 +19,8 @@ class Category(Base):
     name: Mapped[str]
     uri: Mapped[str]
     parent_id: Mapped[int | None] = mapped_column(ForeignKey("category.id"), nullable=True)
+    product_count: Mapped[int | None]  # as reported by the API when the category was loaded
+    path: Mapped[str | None]  # "Root > ... > name", see app.loader.refresh_category_paths
 
     parent: Mapped[Optional["Category"]] = relationship(
         back_populates="children", remote_side="Category.id", lazy="joined"
@@ -41,6 +43,9 @@ class Category(Base):
     )
 
     def text_embedding(self):
+        # the materialized path saves walking the ancestors, it's only missing for categories not loaded yet
+        if self.path is not None:
+            return self.path
         return f"{self.parent.text_embedding() + ' > ' if self.parent_id else ''}{self.name}"
 
     def __repr__(self):
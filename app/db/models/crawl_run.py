@@ -0,0 +1,41 @@
+from datetime import datetime
+from enum import StrEnum
+
+from sqlalchemy import DateTime, ForeignKey
+from sqlalchemy.orm import Mapped, mapped_column
+
+from .base import Base, utc_now
+
+
+class CrawlKind(StrEnum):
+    categories = "categories"
+    products = "products"
+    prices = "prices"
+
+
+class CrawlStatus(StrEnum):
+    running = "running"
+    finished = "finished"
+
+
+class CrawlRun(Base):
+    __tablename__ = "crawl_run"
+    id: Mapped[int] = mapped_column(primary_key=True)
+    kind: Mapped[str]  # CrawlKind
+    status: Mapped[str] = mapped_column(default=CrawlStatus.running)
+    started_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=utc_now)
+    finished_at: Mapped[datetime | None] = mapped_column(DateTime(timezone=True))
+
+    def __repr__(self):
+        return f"<CrawlRun id={self.id} kind={self.kind} status={self.status} started_at={self.started_at}>"
+
+
+class CrawlCheckpoint(Base):
+    """Progress of a crawl run within a single category."""
+
+    __tablename__ = "crawl_checkpoint"
+    run_id: Mapped[int] = mapped_column(ForeignKey("crawl_run.id", ondelete="CASCADE"), primary_key=True)
+    category_id: Mapped[int] = mapped_column(ForeignKey("category.id"), primary_key=True)
+    last_page: Mapped[int] = mapped_column(default=0)  # the last page written, without gaps before it
+    status: Mapped[str] = mapped_column(default=CrawlStatus.running)
+    updated_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=utc_now)
@@ -2,6 +2,7 @@ from datetime import datetime
 from typing import TYPE_CHECKING, Optional
 
 from sqlalchemy import DateTime
+from sqlalchemy.dialects.postgresql import TSVECTOR
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 
 from .base import Base, utc_now
@@ -63,6 +64,9 @@ class Product(Base):
     information: Mapped[str]
     rating_value: Mapped[float | None]
     rating_reviews: Mapped[int | None]
+    content_hash: Mapped[str | None]  # of the imported fields, see app.loader.product_hash
+    # name, brand and category paths for full-text search, see app.loader.refresh_search_vectors
+    search_vector: Mapped[str | None] = mapped_column(TSVECTOR, deferred=True)
 
     created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=utc_now)
     updated_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=utc_now)
@@ -98,17 +102,18 @@ class Product(Base):
         if self.producer_country:
             parts.append(f"Страна: {self.producer_country}")
 
-        # Categories with sort position
+        # Categories, sorted as they are loaded in no particular order. Positions in them shift on every crawl,
+        # they'd have the product re-embedded each time (see app.embedder.iter_stale_texts)
         cat_parts = []
         for pc in self.product_categories:
             cat: Category = pc.category
-            cat_parts.append(f"- {cat.text_embedding()} (позиция №{pc.sort_pos})")
+            cat_parts.append(f"- {cat.text_embedding()}")
         if cat_parts:
-            parts.append("Продукт находится в категориях: \n" + "\n".join(cat_parts))
+            parts.append("Продукт находится в категориях: \n" + "\n".join(sorted(cat_parts)))
 
         # Features
         if self.features:
-            parts.append("Особенности: " + ", ".join([feat.name for feat in self.features]))
+            parts.append("Особенности: " + ", ".join(sorted(feat.name for feat in self.features)))
 
         # Ingredients
         if self.ingredients:
@@ -1,10 +1,12 @@
 from datetime import datetime
 from typing import TYPE_CHECKING
 
-from pgvector.sqlalchemy import Vector
+from pgvector.sqlalchemy import HALFVEC, VECTOR
 from sqlalchemy import DateTime, ForeignKey
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 
+from app.config import settings
+
 from .base import Base, utc_now
 
 if TYPE_CHECKING:
@@ -18,7 +20,12 @@ class ProductEmbedding(Base):
     updated_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=utc_now)
 
     text: Mapped[str]
-    vector: Mapped[list[float]] = mapped_column(Vector(1536))  # for text-embedding-3-small
+    text_hash: Mapped[str | None]  # of the text, see app.embedder.text_hash
+    model: Mapped[str | None]  # that made the vector, see app.gpt.embeddings.embedding_key
+    # of the configured dimension and storage, see app.embedder.convert_embedding_storage
+    vector: Mapped[list[float]] = mapped_column(
+        (HALFVEC if settings.embedding_storage == "halfvec" else VECTOR)(settings.embedding_dimension)
+    )
 
     product_id: Mapped[int] = mapped_column(ForeignKey("product.id"), unique=True)
     product: Mapped["Product"] = relationship(back_populates="embedding", lazy="joined")
@@ -0,0 +1,19 @@
+from datetime import datetime
+
+from pgvector.sqlalchemy import VECTOR
+from sqlalchemy import DateTime
+from sqlalchemy.orm import Mapped, mapped_column
+
+from .base import Base, utc_now
+
+
+class QueryEmbedding(Base):
+    """Vectors of search queries, see app.gpt.embeddings.get_query_embeddings."""
+
+    __tablename__ = "query_embedding"
+
+    model: Mapped[str] = mapped_column(primary_key=True)  # see app.gpt.embeddings.embedding_key
+    text: Mapped[str] = mapped_column(primary_key=True)  # normalized
+    # of any dimension, it's a part of the model key
+    vector: Mapped[list[float]] = mapped_column(VECTOR())
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=utc_now)
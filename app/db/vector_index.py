@@ -0,0 +1,77 @@
+"""
+Approximate nearest neighbour index of `ProductEmbedding.vector`, for cosine distance.
+
+The migrations build a vchordrq index for the default settings, `rebuild_vector_index` (also
+``python -m app.db.vector_index``) builds the configured one, after switching it or the embedding storage.
+
+vchordrq (VectorChord) clusters the vectors into lists at build time and searches the closest ones,
+so the lists drift away from the data after bulk re-embeds and the index has to be rebuilt.
+hnsw (pgvector) is updated in place, rebuilding only reclaims the space of the replaced vectors.
+"""
+
+import logging
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session as SessionClass
+
+from app.config import settings
+
+from .session import Session
+
+log = logging.getLogger(__name__)
+
+INDEX_NAME = "ix_product_embedding_vector"
+
+
+def index_lists(rows: int) -> int:
+    return settings.vector_index_lists or max(1, rows // 1000)
+
+
+def create_index_sql(
+    name: str = INDEX_NAME, rows: int = 0, concurrently: bool = False, storage: str | None = None
+) -> str:
+    """DDL of the configured index, vchordrq lists are sized for the given rows."""
+    ops = f"{storage or settings.embedding_storage}_cosine_ops"
+    create = f"CREATE INDEX {'CONCURRENTLY ' if concurrently else ''}{name} ON product_embedding"
+    if settings.vector_index == "hnsw":
+        return f"{create} USING hnsw (vector {ops})"
+    # spherical centroids suit the cosine distance, residual quantization only helps the L2 one
+    options = (
+        f"residual_quantization = false\n[build.internal]\nlists = [{index_lists(rows)}]\nspherical_centroids = true"
+    )
+    return f"{create} USING vchordrq (vector {ops}) WITH (options = $${options}$$)"
+
+
+def set_search_parameters(session: SessionClass):
+    """Index search parameters of the settings, for the current transaction."""
+    session.execute(
+        text("SELECT set_config('vchordrq.probes', :probes, true), set_config('hnsw.ef_search', :ef, true)"),
+        {"probes": str(settings.vector_search_probes), "ef": str(settings.vector_search_ef)},
+    )
+
+
+def rebuild_vector_index(storage: str | None = None):
+    """
+    Build the index anew next to the current one and swap them, for the storage of the settings unless given.
+
+    Both builds are concurrent, so embeddings are written and searched with the old index meanwhile.
+    """
+    new_name = f"{INDEX_NAME}_new"
+    with Session() as s:
+        engine = s.get_bind()
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        if settings.vector_index == "vchordrq":
+            # the migrations create it, unless the index was switched from hnsw on a database without it
+            conn.execute(text("CREATE EXTENSION IF NOT EXISTS vchord CASCADE"))
+        rows = conn.scalar(text("SELECT count(*) FROM product_embedding"))
+        # left by an interrupted rebuild, invalid
+        conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {new_name}"))
+        log.info("building %s index of %d embeddings", settings.vector_index, rows)
+        conn.execute(text(create_index_sql(new_name, rows, concurrently=True, storage=storage)))
+    with engine.begin() as conn:
+        conn.execute(text(f"DROP INDEX IF EXISTS {INDEX_NAME}"))
+        conn.execute(text(f"ALTER INDEX {new_name} RENAME TO {INDEX_NAME}"))
+
+
+if __name__ == "__main__":
+    rebuild_vector_index()
@@ -1,28 +1,201 @@
-from sqlalchemy import select
+import argparse
+import hashlib
+import logging
+import time
+from collections.abc import Iterator
 
-from app.gpt.embeddings import batch, get_embeddings
+import psycopg
+from pgvector import Vector
+from pgvector.psycopg import register_vector
+from sqlalchemy import func, select, text
+from sqlalchemy.orm import Session as SessionClass, lazyload, load_only, selectinload
+
+from app.config import settings
+from app.gpt.embeddings import MinuteBudget, embed_concurrently, embedding_key, token_batches
+from app.gpt.providers import get_provider
+from app.metrics import run_report
 
 from .db import Session
-from .db.models import Product
+from .db.embedding_storage import MIGRATED_DIMENSION, MIGRATED_STORAGE, column_type, convert_column
+from .db.models import Category, Feature, Product, ProductCategory
 from .db.models.product_embedding import ProductEmbedding
+from .db.vector_index import rebuild_vector_index
+
+log = logging.getLogger(__name__)
+
+
+def text_hash(product_text: str) -> str:
+    return hashlib.sha256(product_text.encode()).hexdigest()
+
+
+# everything `Product.text_embedding` reads, besides categories and features
+TEXT_COLUMNS = (
+    Product.name,
+    Product.brand_name,
+    Product.producer_country,
+    Product.ingredients,
+    Product.nutrition_fats,
+    Product.nutrition_carbs,
+    Product.nutrition_protein,
+    Product.nutrition_kcal,
+    Product.rating_value,
+    Product.rating_reviews,
+)
+
+
+def iter_stale_texts(session: SessionClass, chunk_size: int = 1000) -> Iterator[tuple[int, str]]:
+    """
+    Embedding texts of products that have no embedding, or have one of a different text or model, with their ids.
+
+    Products are read in chunks ordered by id (keyset pagination), with only the columns the text needs,
+    so memory stays flat regardless of the catalog size. Categories are loaded once and looked up
+    by the products in the identity map, so the session must not expire them on commit.
+    """
+    # keeps every category in the identity map for the duration of the walk, with its path to render
+    # (parents are still there for the categories which don't have one yet)
+    _categories = session.scalars(select(Category).options(lazyload(Category.children))).all()
+    model = embedding_key()
+    last_id = 0
+    while True:
+        rows = session.execute(
+            select(Product, ProductEmbedding.text_hash, ProductEmbedding.model)
+            .outerjoin(ProductEmbedding, ProductEmbedding.product_id == Product.id)
+            .options(
+                load_only(*TEXT_COLUMNS),
+                lazyload(Product.embedding),
+                lazyload(Product.categories),
+                selectinload(Product.features).load_only(Feature.name),
+                selectinload(Product.product_categories).lazyload(ProductCategory.category),
+            )
+            .where(Product.id > last_id)
+            .order_by(Product.id)
+            .limit(chunk_size)
+        ).all()
+        if not rows:
+            break
+        for product, stored_hash, stored_model in rows:
+            product_text = product.text_embedding()
+            if stored_model != model or stored_hash != text_hash(product_text):
+                yield product.id, product_text
+        last_id = rows[-1][0].id
+        log.debug("products up to id %d checked", last_id)
+
+
+def register_vector_type(conn: psycopg.Connection):
+    """Let psycopg dump `pgvector.Vector` in binary, once per connection."""
+    if conn.adapters.types.get("vector") is None:
+        register_vector(conn)
+
+
+def upsert_embeddings(session: SessionClass, product_ids: list[int], texts: list[str], vectors: list[list[float]]):
+    """
+    Stream embeddings into a temporary table with a binary COPY and upsert them from it with one statement.
+
+    Vectors travel as packed float4 instead of 1536 text parameters each. The table lives until the commit,
+    so it's one call per transaction.
+    """
+    session.execute(
+        text(
+            "CREATE TEMP TABLE product_embedding_stage ("
+            "product_id integer PRIMARY KEY, text text, text_hash varchar, model varchar, vector vector"
+            ") ON COMMIT DROP"
+        )
+    )
+    # COPY isn't exposed by SQLAlchemy, it goes through the psycopg connection of the same transaction
+    conn = session.connection().connection.driver_connection
+    register_vector_type(conn)
+    model = embedding_key()
+    with (
+        conn.cursor() as cur,
+        cur.copy(
+            "COPY product_embedding_stage (product_id, text, text_hash, model, vector) FROM STDIN WITH (FORMAT BINARY)"
+        ) as copy,
+    ):
+        copy.set_types(["int4", "text", "varchar", "varchar", "vector"])
+        for product_id, product_text, vector in zip(product_ids, texts, vectors, strict=True):
+            copy.write_row((product_id, product_text, text_hash(product_text), model, Vector(vector)))
+    session.execute(
+        text(
+            "INSERT INTO product_embedding (product_id, text, text_hash, model, vector, created_at, updated_at) "
+            "SELECT product_id, text, text_hash, model, vector, now(), now() FROM product_embedding_stage "
+            "ON CONFLICT (product_id) DO UPDATE SET "
+            "text = excluded.text, text_hash = excluded.text_hash, model = excluded.model, vector = excluded.vector, "
+            "updated_at = excluded.updated_at"
+        )
+    )
 
 
 def generate_embeddings():
-    i = 0
-    with Session() as session:
-        qs = select(Product).where(Product.embedding.is_(None))
-        products = session.scalars(qs).all()
-        for product_batch in batch(products, size=100):
-            texts = [p.text_embedding() for p in product_batch]
-            embs = get_embeddings(texts)
-            for product, emb, text in zip(
-                product_batch,
-                embs,
-                texts,
-                strict=False,
+    """Embed new products and re-embed the ones whose embedding text changed since."""
+    # fails before reading anything if the provider can't make vectors of the configured dimension
+    get_provider()
+    with run_report("embeddings") as report:
+        # categories are walked by iter_stale_texts across the commits
+        with Session(expire_on_commit=False) as session:
+            stale = iter_stale_texts(session, settings.embedding_chunk_size)
+            batches = token_batches(stale, settings.embedding_batch_tokens, settings.embedding_batch_size)
+            budget = MinuteBudget(settings.embedding_rpm, settings.embedding_tpm)
+            done = failed = 0
+            started = time.monotonic()
+            for items, vectors in embed_concurrently(
+                batches, budget, concurrency=settings.embedding_concurrency, max_retries=settings.embedding_max_retries
             ):
-                embedding = ProductEmbedding(vector=emb.embedding, text=text, product=product)
-                session.add(embedding)
-            session.commit()
-            i += len(embs)
-            print(f"{i} embeddings generated")
+                if vectors is None:
+                    # left stale, so the next run picks them up
+                    failed += len(items)
+                    report.inc("embeddings_failed_total", len(items))
+                    continue
+                product_ids, texts = zip(*items, strict=True)
+                upsert_embeddings(session, list(product_ids), list(texts), vectors)
+                session.commit()
+                done += len(vectors)
+                report.inc("embeddings_total", len(vectors))
+                log.info("%d embeddings generated, %.1f/s", done, done / (time.monotonic() - started))
+            if failed:
+                log.info("%d products failed to embed", failed)
+            total = session.scalar(select(func.count()).select_from(ProductEmbedding))
+        # lists of a vchordrq index are clustered at build time, a bulk re-embed leaves them off
+        if done and done >= settings.vector_index_rebuild_share * total:
+            with report.timer("vector_index_rebuild_seconds"):
+                rebuild_vector_index()
+
+
+def convert_embedding_storage(storage: str | None = None, dimension: int | None = None):
+    """Convert the stored vectors to the storage and dimension, of the settings unless given, and index them again."""
+    storage = storage or settings.embedding_storage
+    dimension = dimension or settings.embedding_dimension
+    with Session.begin() as s:
+        _, current_dimension = column_type(s)
+        if not convert_column(s, storage, dimension):
+            log.info("embeddings are already stored as %s(%d)", storage, dimension)
+            return
+        if current_dimension and current_dimension > dimension:
+            # cut to what get_embeddings makes of the same vectors, they don't have to be made again
+            s.execute(
+                text("UPDATE product_embedding SET model = :model WHERE model = :current"),
+                {"model": embedding_key(dimension), "current": embedding_key(current_dimension)},
+            )
+    rebuild_vector_index(storage)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=generate_embeddings.__doc__)
+    storage_args = parser.add_mutually_exclusive_group()
+    storage_args.add_argument(
+        "--convert-storage",
+        action="store_true",
+        help="first convert the stored vectors to embedding_storage and embedding_dimension of the settings",
+    )
+    storage_args.add_argument(
+        "--reset-storage",
+        action="store_true",
+        help=f"only convert them back to {MIGRATED_STORAGE}({MIGRATED_DIMENSION}) of the migrations, to downgrade",
+    )
+    args = parser.parse_args()
+    if args.reset_storage:
+        convert_embedding_storage(MIGRATED_STORAGE, MIGRATED_DIMENSION)
+    else:
+        if args.convert_storage:
+            convert_embedding_storage()
+        # rebuilds the index again if most of the embeddings are made anew
+        generate_embeddings()
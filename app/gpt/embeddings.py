@@ -1,6 +1,29 @@
-from openai.types import Embedding
+import logging
+import threading
+import time
+from collections import Counter, OrderedDict
+from collections.abc import Iterable, Iterator
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
 
-from .openai import client
+import numpy as np
+import openai
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert
+
+from app.config import settings
+from app.db import Session
+from app.db.models import QueryEmbedding
+from app.http_cache import write_atomic
+from app.metrics import format_labels
+
+from .providers import get_provider
+
+log = logging.getLogger(__name__)
+
+# tokens of text-embedding-3-small are rarely shorter than 2 bytes of UTF-8 for Russian text,
+# an overestimate only makes batches smaller
+BYTES_PER_TOKEN = 2
+RETRIABLE_ERRORS = (openai.RateLimitError, openai.APIConnectionError, openai.InternalServerError)
 
 
 def batch(iterable, size):
@@ -8,6 +31,285 @@ def batch(iterable, size):
         yield iterable[i : i + size]
 
 
-def get_embeddings(texts: list[str]) -> list[Embedding]:
-    rs = client.embeddings.create(input=texts, model="text-embedding-3-small")
-    return rs.data
+def shorten(vector: list[float], dimension: int) -> list[float]:
+    """
+    Cut the vector to the dimension and normalize it back.
+
+    For text-embedding-3 models that's the same as asking the API for a shorter vector.
+    """
+    v = np.asarray(vector[:dimension], dtype=np.float32)
+    norm = np.linalg.norm(v)
+    return (v / norm if norm else v).tolist()
+
+
+def get_embeddings(texts: list[str]) -> list[list[float]]:
+    """Vectors of the texts, made by the configured provider and cut to the configured dimension."""
+    vectors = get_provider().embed(texts)
+    dimension = settings.embedding_dimension
+    return [shorten(vector, dimension) if len(vector) > dimension else vector for vector in vectors]
+
+
+def embedding_key(dimension: int | None = None) -> str:
+    """Provider, model and dimension of the vectors, ones made by another key don't compare with them."""
+    provider = settings.embedding_provider
+    model = {"openai": settings.embedding_model, "local": str(settings.embedding_model_path)}.get(provider, provider)
+    return f"{provider}/{model}@{dimension or settings.embedding_dimension}"
+
+
+def normalize_query(text: str) -> str:
+    return " ".join(text.lower().replace("ё", "е").split())
+
+
+class QueryCache:
+    """
+    Vectors of search queries by their key, the least recently used ones are evicted past the size.
+
+    Counts where the vectors of the searches came from, the loader metrics aren't collected in the search process.
+    Safe to use from several threads.
+    """
+
+    SOURCES = ("memory", "database", "provider")
+
+    def __init__(self, size: int):
+        self.size = size
+        self.request_seconds: float | None = None  # moving average of the provider requests, for the time saved
+        self.sources: Counter[str] = Counter()  # memory, database or provider
+        self.saved_seconds = 0.0
+        self.lookup_seconds = 0.0  # spent in the database
+        self._vectors: OrderedDict[tuple[str, str], list[float]] = OrderedDict()
+        self._exported_at = float("-inf")
+        self._lock = threading.Lock()
+
+    def get(self, key: tuple[str, str]) -> list[float] | None:
+        with self._lock:
+            vector = self._vectors.get(key)
+            if vector is not None:
+                self._vectors.move_to_end(key)
+            return vector
+
+    def put(self, key: tuple[str, str], vector: list[float]):
+        with self._lock:
+            self._vectors[key] = vector
+            self._vectors.move_to_end(key)
+            while len(self._vectors) > self.size:
+                self._vectors.popitem(last=False)
+
+    def observe_request(self, seconds: float):
+        with self._lock:
+            self.request_seconds = (
+                seconds if self.request_seconds is None else 0.9 * self.request_seconds + 0.1 * seconds
+            )
+
+    def count(self, sources: list[str], saved_seconds: float = 0, lookup_seconds: float = 0):
+        with self._lock:
+            self.sources.update(sources)
+            self.saved_seconds += saved_seconds
+            self.lookup_seconds += lookup_seconds
+
+    def stats(self) -> dict:
+        """Vectors by source, the share of them served without a request and the request time saved so far."""
+        with self._lock:
+            total = self.sources.total()
+            return {
+                **self.sources,
+                "hit_rate": round(1 - self.sources["provider"] / total, 3) if total else None,
+                "saved_seconds": round(self.saved_seconds, 3),
+                "lookup_seconds": round(self.lookup_seconds, 3),
+            }
+
+    def to_prometheus(self, prefix: str = "arbuz_search_") -> str:
+        """Text exposition format of the counters, the hit rate is left to the queries."""
+        with self._lock:
+            lines = [f"# TYPE {prefix}query_embeddings_total counter"]
+            lines += [
+                f"{prefix}query_embeddings_total{format_labels((('source', source),))} {self.sources[source]}"
+                for source in self.SOURCES
+            ]
+            for name, value in (("saved", self.saved_seconds), ("lookup", self.lookup_seconds)):
+                lines += [
+                    f"# TYPE {prefix}query_embedding_{name}_seconds_total counter",
+                    f"{prefix}query_embedding_{name}_seconds_total {value}",
+                ]
+        return "\n".join(lines) + "\n"
+
+    def export_due(self, interval: float) -> bool:
+        """Whether the interval passed since the last export, which it then counts from."""
+        with self._lock:
+            now = time.monotonic()
+            if now - self._exported_at < interval:
+                return False
+            self._exported_at = now
+            return True
+
+
+query_cache = QueryCache(settings.query_cache_size)
+
+
+def load_query_embeddings(model: str, texts: list[str]) -> dict[str, list[float]]:
+    with Session() as s:
+        rows = s.execute(
+            select(QueryEmbedding.text, QueryEmbedding.vector).where(
+                QueryEmbedding.model == model, QueryEmbedding.text.in_(texts)
+            )
+        )
+        return {text: vector.tolist() for text, vector in rows}
+
+
+def export_query_cache_stats():
+    """Write the counters of the query cache to the textfile of the settings, at most once per interval."""
+    path = settings.query_cache_prometheus_file
+    if path is not None and query_cache.export_due(settings.query_cache_report_interval):
+        write_atomic(path, query_cache.to_prometheus().encode())
+
+
+def store_query_embeddings(model: str, vectors: dict[str, list[float]]):
+    with Session.begin() as s:
+        s.execute(
+            insert(QueryEmbedding)
+            .values([{"model": model, "text": text, "vector": vector} for text, vector in vectors.items()])
+            .on_conflict_do_nothing()
+        )
+
+
+def get_query_embeddings(texts: list[str]) -> list[list[float]]:
+    """
+    Vectors of search queries, by their normalized text.
+
+    Looked up in memory first, then in the query_embedding table, the rest is embedded with one request
+    and stored in both.
+    """
+    model = embedding_key()
+    normalized = [normalize_query(text) for text in texts]
+    vectors: dict[str, list[float]] = {}
+    sources: dict[str, str] = {}
+    for text in dict.fromkeys(normalized):
+        vector = query_cache.get((model, text))
+        if vector is not None:
+            vectors[text], sources[text] = vector, "memory"
+    lookup_seconds = 0.0
+    if missing := [text for text in dict.fromkeys(normalized) if text not in vectors]:
+        started = time.perf_counter()
+        for text, vector in load_query_embeddings(model, missing).items():
+            vectors[text], sources[text] = vector, "database"
+            query_cache.put((model, text), vector)
+        lookup_seconds = time.perf_counter() - started
+    if new := [text for text in missing if text not in vectors]:
+        started = time.perf_counter()
+        new_vectors = dict(zip(new, get_embeddings(new), strict=True))
+        query_cache.observe_request(time.perf_counter() - started)
+        store_query_embeddings(model, new_vectors)
+        for text, vector in new_vectors.items():
+            vectors[text], sources[text] = vector, "provider"
+            query_cache.put((model, text), vector)
+    # a request is saved if there was none, less the database lookup made instead
+    saved_seconds = 0 if new else max(0.0, (query_cache.request_seconds or 0) - lookup_seconds)
+    query_cache.count([sources[text] for text in normalized], saved_seconds, lookup_seconds)
+    export_query_cache_stats()
+    return [vectors[text] for text in normalized]
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text.encode()) // BYTES_PER_TOKEN + 1
+
+
+def token_batches(texts: Iterable[tuple[int, str]], max_tokens: int, max_size: int) -> Iterator[list[tuple[int, str]]]:
+    """Group texts (by their ids) into batches of at most ``max_tokens`` estimated tokens and ``max_size`` texts."""
+    current, tokens = [], 0
+    for item in texts:
+        item_tokens = estimate_tokens(item[1])
+        if current and (tokens + item_tokens > max_tokens or len(current) == max_size):
+            yield current
+            current, tokens = [], 0
+        current.append(item)
+        tokens += item_tokens
+    if current:
+        yield current
+
+
+class MinuteBudget:
+    """
+    Requests and tokens per minute shared by the threads calling the API.
+
+    Both are token buckets refilled continuously, holding at most a minute worth of budget.
+    """
+
+    def __init__(self, rpm: int, tpm: int):
+        self.rpm = rpm
+        self.tpm = tpm
+        self._requests = float(rpm)
+        self._tokens = float(tpm)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens: int):
+        # a request bigger than the whole budget waits for a full one
+        tokens = min(tokens, self.tpm)
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                elapsed, self._updated = now - self._updated, now
+                self._requests = min(self.rpm, self._requests + elapsed * self.rpm / 60)
+                self._tokens = min(self.tpm, self._tokens + elapsed * self.tpm / 60)
+                if self._requests >= 1 and self._tokens >= tokens:
+                    self._requests -= 1
+                    self._tokens -= tokens
+                    return
+                delay = max((1 - self._requests) * 60 / self.rpm, (tokens - self._tokens) * 60 / self.tpm)
+            time.sleep(delay)
+
+
+def embed_batch(
+    texts: list[str], budget: MinuteBudget, max_retries: int = 5, backoff_factor: float = 2
+) -> list[list[float]]:
+    """`get_embeddings` within the budget, retried on rate limits and transient errors."""
+    tokens = sum(estimate_tokens(text) for text in texts)
+    attempt = 0
+    while True:
+        budget.acquire(tokens)
+        try:
+            return get_embeddings(texts)
+        except RETRIABLE_ERRORS as e:
+            if attempt == max_retries:
+                raise
+            delay = backoff_factor * 2**attempt
+            attempt += 1
+            log.warning("embedding %d texts failed (%s), retry %d in %.1fs", len(texts), e, attempt, delay)
+            time.sleep(delay)
+
+
+def embed_concurrently(
+    batches: Iterable[list[tuple[int, str]]],
+    budget: MinuteBudget,
+    concurrency: int = 4,
+    max_retries: int = 5,
+) -> Iterator[tuple[list[tuple[int, str]], list[list[float]] | None]]:
+    """
+    Embed batches with several requests in flight, yield them with their embeddings as they complete.
+
+    A batch that fails for good is yielded with None instead of vectors, the rest of them go on.
+    """
+    batches = iter(batches)
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="embed") as executor:
+        pending: dict[Future, list[tuple[int, str]]] = {}
+
+        def submit(count: int):
+            for items in batches:
+                future = executor.submit(embed_batch, [text for _, text in items], budget, max_retries)
+                pending[future] = items
+                count -= 1
+                if not count:
+                    break
+
+        # a couple of batches queued per worker, so the workers never wait for the caller
+        submit(concurrency * 2)
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                items = pending.pop(future)
+                try:
+                    vectors = future.result()
+                except openai.OpenAIError:
+                    log.exception("failed to embed a batch of %d texts", len(items))
+                    vectors = None
+                yield items, vectors
+            submit(len(done))
@@ -0,0 +1,216 @@
+"""
+Product embeddings in a NumPy matrix, searched in process instead of sorting by distance in Postgres.
+
+The catalog is small enough to fit in memory: a search is a matrix multiplication of all the vectors
+with the query ones, and the results are the same as the ones of an exact search in Postgres.
+With a path, vectors are kept in ``.npy`` files and memory-mapped, so processes share them through the page cache.
+With quantization, an int8 copy of the vectors (a quarter of the size) is scanned, and every product the rounding
+of its codes could put among the best is re-ranked with the full vectors, so the results stay exact and only
+the rows of these candidates are read from the mapped file.
+"""
+
+import json
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+from functools import cache
+from pathlib import Path
+
+import numpy as np
+from pgvector.sqlalchemy import VECTOR
+from sqlalchemy import cast, func, or_, select
+
+from app.config import settings
+from app.db import Session
+from app.db.models import Product, ProductEmbedding
+
+from .embeddings import embedding_key
+
+log = logging.getLogger(__name__)
+
+# transactions commit after the time they stamp their rows with, changes are read again for a while
+REFRESH_OVERLAP = timedelta(minutes=1)
+# rows multiplied at once, bounds the memory the scores and the dequantized vectors take
+SCAN_ROWS = 8192
+# of float32 sums, on top of the rounding error of the codes
+SCORE_SLACK = 1e-5
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms, norms, 1)
+
+
+def quantize(vectors: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """int8 codes of the vectors and the scale of every row."""
+    scales = np.abs(vectors).max(axis=1) / 127
+    scales[scales == 0] = 1
+    return np.round(vectors / scales[:, None]).astype(np.int8), scales.astype(np.float32)
+
+
+class ProductIndex:
+    def __init__(self, path: Path | None = None, quantized: bool = False):
+        self.path = path
+        self.quantized = quantized
+        self.key = embedding_key()
+        self.ids = np.empty(0, dtype=np.int64)  # sorted
+        self.vectors = np.empty((0, 0), dtype=np.float32)  # normalized, in the order of the ids
+        self.available = np.empty(0, dtype=bool)
+        self.codes: np.ndarray | None = None
+        self.scales: np.ndarray | None = None
+        self.updated_at: datetime | None = None  # the latest change read
+        self.refreshed = 0.0  # monotonic
+        self._lock = threading.Lock()
+        if path and (path / "meta.json").exists():
+            self.load()
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def load(self):
+        meta = json.loads((self.path / "meta.json").read_text())
+        if meta["key"] != self.key:
+            log.warning("product index at %s is of %s, not %s, rebuilding it", self.path, meta["key"], self.key)
+            return
+        # copy-on-write, a refresh changes rows in place without touching the file
+        self.vectors = np.load(self.path / "vectors.npy", mmap_mode="c")
+        self.ids = np.load(self.path / "ids.npy")
+        self.available = np.load(self.path / "available.npy")
+        self.updated_at = datetime.fromisoformat(meta["updated_at"]) if meta["updated_at"] else None
+        if self.quantized:
+            self.codes, self.scales = quantize(self.vectors)
+
+    def save(self):
+        self.path.mkdir(parents=True, exist_ok=True)
+        # written next to the mapped files and renamed over them, so readers of the old ones don't break
+        for name, array in (("vectors", self.vectors), ("ids", self.ids), ("available", self.available)):
+            np.save(self.path / f"{name}.tmp.npy", array)
+            (self.path / f"{name}.tmp.npy").replace(self.path / f"{name}.npy")
+        meta = {"key": self.key, "updated_at": self.updated_at.isoformat() if self.updated_at else None}
+        (self.path / "meta.tmp.json").write_text(json.dumps(meta))
+        (self.path / "meta.tmp.json").replace(self.path / "meta.json")
+
+    def refresh(self) -> int:
+        """
+        Read the embeddings and availability changed since the previous refresh, all of them the first time.
+
+        Deleted embeddings leave no change to read, the ids of all of them are compared instead.
+        """
+        changed_at = func.greatest(ProductEmbedding.updated_at, Product.updated_at)
+        query = (
+            select(
+                ProductEmbedding.product_id, cast(ProductEmbedding.vector, VECTOR()), Product.is_available, changed_at
+            )
+            .join(ProductEmbedding.product)
+            .order_by(ProductEmbedding.product_id)
+        )
+        if self.updated_at:
+            since = self.updated_at - REFRESH_OVERLAP
+            query = query.where(or_(ProductEmbedding.updated_at >= since, Product.updated_at >= since))
+        with Session() as s:
+            rows = s.execute(query).all()
+            # read after the changes, so an embedding deleted in between isn't merged back
+            present = np.array(s.scalars(select(ProductEmbedding.product_id)).all(), dtype=np.int64)
+        with self._lock:
+            self.refreshed = time.monotonic()
+            if rows:
+                ids = np.array([row[0] for row in rows], dtype=np.int64)
+                vectors = normalize(np.array([row[1] for row in rows], dtype=np.float32))
+                available = np.array([row[2] for row in rows], dtype=bool)
+                self.merge(ids, vectors, available)
+                self.updated_at = max(self.updated_at or rows[0][3], *(row[3] for row in rows))
+            removed = self.remove(present)
+            if not rows and not removed:
+                return 0
+            if self.quantized:
+                self.codes, self.scales = quantize(self.vectors)
+            if self.path:
+                self.save()
+                self.vectors = np.load(self.path / "vectors.npy", mmap_mode="c")
+        log.info("%d product embeddings refreshed, %d removed, %d in the index", len(rows), removed, len(self.ids))
+        return len(rows) + removed
+
+    def merge(self, ids: np.ndarray, vectors: np.ndarray, available: np.ndarray):
+        if not len(self.ids):
+            self.ids, self.vectors, self.available = ids, vectors, available
+            return
+        positions = np.searchsorted(self.ids, ids).clip(max=len(self.ids) - 1)
+        known = self.ids[positions] == ids
+        self.vectors[positions[known]] = vectors[known]
+        self.available[positions[known]] = available[known]
+        if known.all():
+            return
+        all_ids = np.concatenate([self.ids, ids[~known]])
+        order = np.argsort(all_ids, kind="stable")
+        self.ids = all_ids[order]
+        self.vectors = np.concatenate([self.vectors, vectors[~known]])[order]
+        self.available = np.concatenate([self.available, available[~known]])[order]
+
+    def remove(self, present: np.ndarray) -> int:
+        """Drop the products missing from the given ids, returns how many."""
+        keep = np.isin(self.ids, present)
+        if keep.all():
+            return 0
+        self.ids, self.vectors, self.available = self.ids[keep], self.vectors[keep], self.available[keep]
+        return int(len(keep) - keep.sum())
+
+    def scores(self, queries: np.ndarray) -> np.ndarray:
+        """Cosine similarity of every product (rows) to every query (columns), approximate if quantized."""
+        if not self.quantized:
+            return self.vectors @ queries.T
+        result = np.empty((len(self.ids), len(queries)), dtype=np.float32)
+        for start in range(0, len(self.ids), SCAN_ROWS):
+            block = slice(start, start + SCAN_ROWS)
+            result[block] = (self.codes[block].astype(np.float32) @ queries.T) * self.scales[block, None]
+        return result
+
+    def search(self, vectors: list[list[float]], limit: int) -> list[list[tuple[int, float]]]:
+        """Ids of the available products closest to every vector, with their cosine distances, nearest first."""
+        queries = normalize(np.asarray(vectors, dtype=np.float32))
+        with self._lock:
+            if not len(self.ids) or not limit:
+                return [[] for _ in vectors]
+            scores = self.scores(queries)
+            scores[~self.available] = -np.inf
+            count = min(limit, len(self.ids))
+            results = []
+            for column, query in enumerate(queries):
+                if self.quantized:
+                    best = self.candidates(scores[:, column], query, count)
+                    # exact similarities, read from the full vectors of the candidates only
+                    similarity = self.vectors[best] @ query
+                else:
+                    best = np.argpartition(-scores[:, column], count - 1)[:count]
+                    best = best[np.isfinite(scores[best, column])]
+                    similarity = scores[best, column]
+                order = np.lexsort((self.ids[best], -similarity))[:limit]
+                results.append([(int(self.ids[best[i]]), float(1 - similarity[i])) for i in order])
+            return results
+
+    def candidates(self, scores: np.ndarray, query: np.ndarray, count: int) -> np.ndarray:
+        """
+        Rows of a quantized search which can be among the ``count`` best ones of the exact search.
+
+        Rounding moves every code by at most half the scale of its row, so a score is off by at most that
+        times the L1 norm of the query. Rows that can't beat the ``count``-th best lower bound are left out.
+        """
+        error = self.scales * (np.abs(query).sum() / 2) + SCORE_SLACK
+        threshold = np.partition(scores - error, -count)[-count]
+        best = np.flatnonzero(scores + error >= threshold)
+        return best[np.isfinite(scores[best])]
+
+
+@cache
+def get_product_index() -> ProductIndex:
+    index = ProductIndex(settings.search_index_path, settings.search_index_quantized)
+    index.refresh()
+    return index
+
+
+def search_index(vectors: list[list[float]], limit: int) -> list[list[tuple[int, float]]]:
+    """`ProductIndex.search` of the shared index, refreshed first if it's older than the configured interval."""
+    index = get_product_index()
+    if time.monotonic() - index.refreshed > settings.search_index_refresh:
+        index.refresh()
+    return index.search(vectors, limit)
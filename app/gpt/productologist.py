@@ -3,21 +3,22 @@ from textwrap import dedent
 from typing import Annotated
 
 import marvin
+from pgvector import HalfVector, Vector
 from pydantic import BaseModel, Field
-from sqlalchemy import select, text
-from sqlalchemy.orm import selectinload
+from sqlalchemy import select
+from sqlalchemy.orm import Session as SessionClass, lazyload, selectinload
 
+from app.config import settings
 from app.db import Session
-from app.db.models import Category, Product, ProductCategory as ProductCategoryModel, ProductEmbedding
-from app.gpt.embeddings import get_embeddings
+from app.db.models import Category, Product, ProductCategory as ProductCategoryModel
+from app.db.vector_index import set_search_parameters
+from app.embedder import register_vector_type
+from app.gpt.embeddings import get_query_embeddings, query_cache
+from app.gpt.product_index import search_index
 
 log = logging.getLogger(__name__)
 
 
-def format_vector(vector: list[float]) -> str:
-    return f"'[{', '.join(str(x) for x in vector)}]'"
-
-
 ProductQuery = Annotated[str, Field(description="Запрос в каталог продуктов")]
 
 
@@ -87,36 +88,120 @@ class ProductSearchFilters(BaseModel):
     max_amount: int = Field(description="Максимальная сумма продукта")
 
 
+# top-k of every query vector in one statement, the index is searched once per vector
+SEARCH_SQL = """
+SELECT q.ord - 1 AS query, c.product_id, c.distance
+FROM unnest(%(vectors)b) WITH ORDINALITY AS q (vector, ord)
+CROSS JOIN LATERAL (
+    SELECT e.product_id, e.vector <=> q.vector AS distance
+    FROM product_embedding e
+    JOIN product p ON p.id = e.product_id
+    WHERE p.is_available
+    ORDER BY e.vector <=> q.vector
+    LIMIT %(limit)s
+) c
+ORDER BY q.ord, c.distance
+"""
+
+
+def search_vectors(session: SessionClass, vectors: list[list[float]], limit: int) -> list[list[tuple[int, float]]]:
+    """Ids of the available products closest to every vector, with their distances, nearest first."""
+    # vectors are bound in binary as an array of the column type, instead of thousands of digits in the SQL,
+    # so the statement is the same on every call and is prepared once per connection.
+    # Binary parameters aren't exposed by SQLAlchemy, it goes through the psycopg connection of the same transaction
+    conn = session.connection().connection.driver_connection
+    register_vector_type(conn)
+    vector_type = HalfVector if settings.embedding_storage == "halfvec" else Vector
+    params = {"vectors": [vector_type(vector) for vector in vectors], "limit": limit}
+    results: list[list[tuple[int, float]]] = [[] for _ in vectors]
+    with conn.cursor() as cur:
+        cur.execute(SEARCH_SQL, params, prepare=True)
+        for query, product_id, distance in cur:
+            results[query].append((product_id, distance))
+    return results
+
+
+# top-k of every query by full-text search, any of its words matches and more of them rank higher
+TEXT_SEARCH_SQL = """
+SELECT q.ord - 1 AS query, c.id, c.rank
+FROM unnest(%(queries)s::text[]) WITH ORDINALITY AS q (text, ord)
+CROSS JOIN LATERAL (
+    SELECT p.id, ts_rank_cd(p.search_vector, tq.query) AS rank
+    FROM product p, replace(plainto_tsquery('russian', q.text)::text, ' & ', ' | ')::tsquery AS tq (query)
+    WHERE p.is_available AND p.search_vector @@ tq.query
+    ORDER BY rank DESC, p.id
+    LIMIT %(limit)s
+) c
+ORDER BY q.ord, c.rank DESC, c.id
+"""
+
+
+def search_texts(session: SessionClass, queries: list[str], limit: int) -> list[list[tuple[int, float]]]:
+    """Ids of the available products matching every query by name, brand or category, with their ranks, best first."""
+    conn = session.connection().connection.driver_connection
+    results: list[list[tuple[int, float]]] = [[] for _ in queries]
+    with conn.cursor() as cur:
+        cur.execute(TEXT_SEARCH_SQL, {"queries": queries, "limit": limit}, prepare=True)
+        for query, product_id, rank in cur:
+            results[query].append((product_id, rank))
+    return results
+
+
+def fuse(*rankings: list[tuple[int, float]], k: int = 60) -> list[tuple[int, float]]:
+    """Reciprocal rank fusion: ids by the sum of ``1 / (k + rank)`` over the rankings they are in, best first."""
+    scores: dict[int, float] = {}
+    for ranking in rankings:
+        for rank, (product_id, _score) in enumerate(ranking, start=1):
+            scores[product_id] = scores.get(product_id, 0) + 1 / (k + rank)
+    return sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+
+
+def search_candidates(
+    session: SessionClass, queries: list[str], vectors: list[list[float]], limit: int
+) -> list[list[tuple[int, float]]]:
+    """Products of every query by the configured index and search mode."""
+    hybrid = settings.search_mode == "hybrid"
+    candidates = max(limit, settings.search_candidates) if hybrid else limit
+    if settings.search_index == "memory":
+        results = search_index(vectors, candidates)
+    else:
+        set_search_parameters(session)
+        results = search_vectors(session, vectors, candidates)
+    if not hybrid:
+        return results
+    lexical = search_texts(session, queries, candidates)
+    return [fuse(*rankings, k=settings.search_rrf_k)[:limit] for rankings in zip(results, lexical, strict=True)]
+
+
 def get_products_by_queries(queries: list[ProductQuery], max_results: int = 20) -> list[Product]:
     log.info("serving queries %s", queries)
-    embs = get_embeddings(queries)
+    vectors = get_query_embeddings(queries)
 
-    product_ids = set()
     with Session() as session:
-        for emb in embs:
-            query_ids = session.scalars(
-                select(ProductEmbedding.product_id)
-                .join(ProductEmbedding.product)
-                .where(Product.is_available)
-                .order_by(text(f"vector <=> {format_vector(emb.embedding)}"))
-                .limit(max_results // len(embs))
-            )
-            product_ids.update(query_ids)
+        results = search_candidates(session, queries, vectors, max_results // len(vectors))
+        log.info("query embeddings so far: %s", query_cache.stats())
+        # best ranks first, queries take turns
+        ranks: dict[int, tuple[int, int]] = {}
+        for query, found in enumerate(results):
+            for rank, (product_id, _distance) in enumerate(found):
+                ranks[product_id] = min(ranks.get(product_id, (rank, query)), (rank, query))
+        product_ids = sorted(ranks, key=ranks.__getitem__)[:max_results]
 
         # join all necessary data
         products = session.scalars(
             select(Product)
             .options(
                 selectinload(Product.features),
+                # categories render their materialized paths, ancestors aren't needed
                 selectinload(Product.product_categories)
                 .joinedload(ProductCategoryModel.category)
-                .joinedload(Category.parent)
-                .joinedload(Category.parent)
-                .joinedload(Category.parent),  # 3 level deep ancestors
+                .lazyload(Category.parent),
+                lazyload(Product.categories),
+                lazyload(Product.embedding),
             )
             .where(Product.id.in_(product_ids))
-            .limit(max_results)
         ).all()
+    products.sort(key=lambda p: ranks[p.id])
 
     log.info("found: %r", products)
     return products
@@ -0,0 +1,106 @@
+import hashlib
+import re
+from functools import cache
+from pathlib import Path
+from typing import Protocol
+
+import numpy as np
+
+from app.config import settings
+
+OPENAI_DIMENSIONS = {
+    "text-embedding-3-small": 1536,
+    "text-embedding-3-large": 3072,
+    "text-embedding-ada-002": 1536,
+}
+
+
+class EmbeddingProvider(Protocol):
+    """Turns texts into vectors of a fixed dimension."""
+
+    dimension: int
+
+    def embed(self, texts: list[str]) -> list[list[float]]: ...
+
+
+class OpenAIProvider:
+    def __init__(self, model: str = "text-embedding-3-small", dimension: int | None = None):
+        self.model = model
+        # text-embedding-3 models can shorten their vectors, the older ones can't
+        self.dimensions = dimension if dimension and model.startswith("text-embedding-3") else None
+        self.dimension = dimension or OPENAI_DIMENSIONS[model]
+
+    def embed(self, texts: list[str]) -> list[list[float]]:
+        # the client needs an API key, other providers don't
+        from .openai import client
+
+        if self.dimensions:
+            rs = client.embeddings.create(input=texts, model=self.model, dimensions=self.dimensions)
+        else:
+            rs = client.embeddings.create(input=texts, model=self.model)
+        return [emb.embedding for emb in rs.data]
+
+
+class LocalProvider:
+    """
+    sentence-transformers model loaded from a local directory, run on the CPU.
+
+    sentence-transformers is an optional dependency, installed with the ``local`` extra.
+    """
+
+    def __init__(self, path: Path):
+        from sentence_transformers import SentenceTransformer
+
+        self.model = SentenceTransformer(str(path), device="cpu")
+        self.dimension = self.model.get_sentence_embedding_dimension()
+
+    def embed(self, texts: list[str]) -> list[list[float]]:
+        return self.model.encode(texts, normalize_embeddings=True, convert_to_numpy=True).tolist()
+
+
+class FakeProvider:
+    """
+    Deterministic embeddings for tests and benchmarks, no model involved.
+
+    Words are hashed into signed buckets of the vector (the hashing trick), so texts sharing words
+    get close vectors and search results still make some sense.
+    """
+
+    def __init__(self, dimension: int = 1536):
+        self.dimension = dimension
+
+    def embed_one(self, text: str) -> list[float]:
+        vector = np.zeros(self.dimension, dtype=np.float32)
+        for word in re.findall(r"\w+", text.lower()):
+            h = int.from_bytes(hashlib.blake2b(word.encode(), digest_size=8).digest(), "little")
+            vector[h % self.dimension] += 1 if h >> 63 else -1
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def embed(self, texts: list[str]) -> list[list[float]]:
+        return [self.embed_one(text) for text in texts]
+
+
+@cache
+def get_provider() -> EmbeddingProvider:
+    """The configured provider, checked once against the dimension the vectors are stored with."""
+    provider = make_provider()
+    # longer vectors are cut to it, shorter ones can't be stored
+    if provider.dimension < settings.embedding_dimension:
+        raise ValueError(
+            f"the embedding provider makes vectors of {provider.dimension} dimensions, "
+            f"embedding_dimension is {settings.embedding_dimension}"
+        )
+    return provider
+
+
+def make_provider() -> EmbeddingProvider:
+    match settings.embedding_provider:
+        case "openai":
+            return OpenAIProvider(settings.embedding_model, settings.embedding_dimension)
+        case "local":
+            if not settings.embedding_model_path:
+                raise ValueError("embedding_model_path is required by the local embedding provider")
+            return LocalProvider(settings.embedding_model_path)
+        case "fake":
+            return FakeProvider(settings.embedding_dimension)
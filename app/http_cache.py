@@ -0,0 +1,191 @@
+import asyncio
+import gzip
+import hashlib
+import json
+import logging
+import os
+import tempfile
+from dataclasses import dataclass
+from datetime import UTC, datetime
+from pathlib import Path
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+log = logging.getLogger(__name__)
+
+# 404 is meaningful for the loader, it marks categories without products
+CACHEABLE_STATUSES = {200, 404}
+STORED_HEADERS = ("content-type", "etag", "last-modified")
+
+
+class ResponseNotCachedError(LookupError):
+    """Raised in the replay mode for a request that was never cached."""
+
+
+def normalize_url(url: str) -> str:
+    parts = urlsplit(url)
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    return urlunsplit((parts.scheme, parts.netloc.lower(), parts.path, query, ""))
+
+
+def write_atomic(path: Path, data: bytes):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=path.parent)
+    with os.fdopen(fd, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+@dataclass
+class CachedResponse:
+    url: str
+    status: int
+    headers: dict[str, str]
+    body: bytes
+
+    def validators(self) -> dict[str, str]:
+        """Headers of a conditional request that revalidates this response."""
+        headers = {}
+        if etag := self.headers.get("etag"):
+            headers["If-None-Match"] = etag
+        if last_modified := self.headers.get("last-modified"):
+            headers["If-Modified-Since"] = last_modified
+        return headers
+
+
+class ResponseCache:
+    """
+    On-disk cache of raw API responses.
+
+    Bodies are stored gzipped under the hash of their content, so identical responses share a file,
+    and each request (method and URL with sorted query params) points to the body it got last time.
+    """
+
+    def __init__(self, root: Path):
+        self.root = root
+
+    def _entry_path(self, method: str, url: str) -> Path:
+        key = hashlib.sha256(f"{method} {normalize_url(url)}".encode()).hexdigest()
+        return self.root / "requests" / key[:2] / f"{key}.json"
+
+    def _body_path(self, digest: str) -> Path:
+        return self.root / "bodies" / digest[:2] / f"{digest}.gz"
+
+    def get(self, url: str, method: str = "GET") -> CachedResponse | None:
+        try:
+            entry = json.loads(self._entry_path(method, url).read_bytes())
+            body = gzip.decompress(self._body_path(entry["body"]).read_bytes())
+        except FileNotFoundError:
+            return None
+        return CachedResponse(url=url, status=entry["status"], headers=entry["headers"], body=body)
+
+    def put(self, url: str, status: int, headers: dict[str, str], body: bytes, method: str = "GET"):
+        digest = hashlib.sha256(body).hexdigest()
+        body_path = self._body_path(digest)
+        if not body_path.exists():
+            write_atomic(body_path, gzip.compress(body))
+        entry = {
+            "url": normalize_url(url),
+            "status": status,
+            "headers": {name.lower(): value for name, value in headers.items() if name.lower() in STORED_HEADERS},
+            "body": digest,
+            "fetched_at": datetime.now(UTC).isoformat(),
+        }
+        write_atomic(self._entry_path(method, url), json.dumps(entry).encode())
+
+
+class CachingAdapter(HTTPAdapter):
+    """
+    `requests` transport adapter that serves responses from a `ResponseCache`.
+
+    Cached responses are revalidated with conditional requests, in the replay mode
+    no request ever reaches the network.
+    """
+
+    def __init__(self, cache: ResponseCache, replay: bool = False, **kwargs):
+        super().__init__(**kwargs)
+        self.cache = cache
+        self.replay = replay
+
+    def send(self, request: requests.PreparedRequest, **kwargs) -> requests.Response:
+        if request.method != "GET":
+            if self.replay:
+                raise ResponseNotCachedError(f"{request.method} {request.url}")
+            return super().send(request, **kwargs)
+
+        cached = self.cache.get(request.url)
+        if self.replay:
+            if not cached:
+                raise ResponseNotCachedError(request.url)
+            return self.build_cached_response(request, cached)
+
+        if cached:
+            request.headers.update(cached.validators())
+        rs = super().send(request, **kwargs)
+        if cached and rs.status_code == 304:
+            log.debug("not modified: %s", request.url)
+            return self.build_cached_response(request, cached)
+        if rs.status_code in CACHEABLE_STATUSES:
+            self.cache.put(request.url, rs.status_code, dict(rs.headers), rs.content)
+        return rs
+
+    def build_cached_response(self, request: requests.PreparedRequest, cached: CachedResponse) -> requests.Response:
+        rs = requests.Response()
+        rs.status_code = cached.status
+        rs.reason = "Cached"
+        rs.headers = CaseInsensitiveDict(cached.headers)
+        rs.encoding = get_encoding_from_headers(rs.headers)
+        rs.url = request.url
+        rs.request = request
+        rs._content = cached.body
+        return rs
+
+
+class CachingTransport(httpx.AsyncBaseTransport):
+    """`httpx` counterpart of `CachingAdapter`."""
+
+    def __init__(self, cache: ResponseCache, transport: httpx.AsyncBaseTransport, replay: bool = False):
+        self.cache = cache
+        self.transport = transport
+        self.replay = replay
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        if request.method != "GET":
+            if self.replay:
+                raise ResponseNotCachedError(f"{request.method} {request.url}")
+            return await self.transport.handle_async_request(request)
+
+        url = str(request.url)
+        cached = await asyncio.to_thread(self.cache.get, url)
+        if self.replay:
+            if not cached:
+                raise ResponseNotCachedError(url)
+            return self.build_cached_response(request, cached)
+
+        if cached:
+            request.headers.update(cached.validators())
+        rs = await self.transport.handle_async_request(request)
+        if cached and rs.status_code == 304:
+            await rs.aclose()
+            log.debug("not modified: %s", url)
+            return self.build_cached_response(request, cached)
+        if rs.status_code not in CACHEABLE_STATUSES:
+            return rs
+
+        # the body is read (and decoded) here, so the response is rebuilt without the encoding headers
+        body = await rs.aread()
+        await rs.aclose()
+        headers = {name: value for name, value in rs.headers.items() if name.lower() in STORED_HEADERS}
+        await asyncio.to_thread(self.cache.put, url, rs.status_code, headers, body)
+        return httpx.Response(rs.status_code, headers=headers, content=body, request=request)
+
+    def build_cached_response(self, request: httpx.Request, cached: CachedResponse) -> httpx.Response:
+        return httpx.Response(cached.status, headers=cached.headers, content=cached.body, request=request)
+
+    async def aclose(self):
+        await self.transport.aclose()
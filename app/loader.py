@@ -1,28 +1,53 @@
+import hashlib
 import json
 import logging
 import re
 import time
+from collections.abc import Collection
+from dataclasses import dataclass, field
 from datetime import UTC, datetime
 from functools import cache
 
+import orjson
 import requests
 from requests import HTTPError, Session as HTTPSession
 from requests.adapters import HTTPAdapter
-from sqlalchemy import desc, select
+from sqlalchemy import Boolean, desc, literal_column, select, text
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.orm import Session as SessionClass
 from urllib3.util.retry import Retry
 
+from app.checkpoint import finish_run, get_progress, save_checkpoint, start_run
 from app.config import settings
 from app.db import Session
-from app.db.models import Category, Feature, Product, ProductCategory
+from app.db.models import (
+    Category,
+    CrawlKind,
+    CrawlStatus,
+    Feature,
+    Product,
+    ProductCategory,
+    product_features,
+)
+from app.http_cache import CachingAdapter, ResponseCache
+from app.metrics import endpoint, metrics, run_report
 from app.schemas.categories import CategorySchema
-from app.schemas.product import ProductCharacteristic, ProductSchema
+from app.schemas.product import ProductCharacteristic, ProductPriceSchema, ProductSchema, product_page_adapter
 
 log = logging.getLogger(__name__)
 
 
+class CountingRetry(Retry):
+    """Retry strategy that counts retries in the run metrics."""
+
+    def increment(self, method=None, url=None, response=None, error=None, *args, **kwargs):
+        status = str(response.status) if response is not None else type(error).__name__
+        metrics.inc("http_retries_total", endpoint=endpoint(url or ""), status=status)
+        return super().increment(method, url, response, error, *args, **kwargs)
+
+
 # A retry strategy
-retry_strategy = Retry(
+retry_strategy = CountingRetry(
     total=3,
     backoff_factor=3,
     status_forcelist=[429, 500, 502, 503, 504],
@@ -34,12 +59,42 @@ retry_strategy = Retry(
 adapter = HTTPAdapter(max_retries=retry_strategy)
 
 
-def login():
+def record_response(rs: requests.Response, **_kwargs):
+    metrics.observe(
+        "http_request_duration_seconds",
+        rs.elapsed.total_seconds(),
+        endpoint=endpoint(rs.url),
+        status=str(rs.status_code),
+    )
+
+
+def http_session() -> HTTPSession:
     s = HTTPSession()
-    s.mount("https://", adapter)
+    s.hooks["response"].append(record_response)
+    session_adapter = adapter
+    if settings.http_cache != "off":
+        cache = ResponseCache(settings.http_cache_dir)
+        session_adapter = CachingAdapter(cache, replay=settings.http_cache == "replay", max_retries=retry_strategy)
+    # plain HTTP is for stand-ins of the API, like the one of the loader benchmark
+    s.mount("https://", session_adapter)
+    s.mount("http://", session_adapter)
+    return s
+
+
+def pause(seconds: float):
+    """Be polite to the API, unless the responses are replayed from the cache."""
+    if settings.crawl_pauses and settings.http_cache != "replay":
+        time.sleep(seconds)
+
+
+def login():
+    s = http_session()
+    if settings.http_cache == "replay":
+        log.info("replaying cached responses, no need to log in")
+        return s
 
     log.info("logging in")
-    rs = s.get("https://arbuz.kz")
+    rs = s.get(str(settings.arbuz_site_url))
     platform_conf_raw_re = re.search(r"window\.platformConfiguration = (.*)?;", rs.text)
     if not platform_conf_raw_re:
         raise ValueError("Failed to retrieve platform configuration")
@@ -59,7 +114,7 @@ def login():
 
 @cache
 def get_base_categories() -> dict[int, CategorySchema]:
-    rs = requests.get("https://arbuz.kz/")
+    rs = http_session().get(str(settings.arbuz_site_url))
     catalog_tree_raw_re = re.search(r"window\.siteCatalogTree = Object\.values\((.*)?\);", rs.text)
     if not catalog_tree_raw_re:
         raise ValueError("Failed to retrieve catalog tree")
@@ -76,40 +131,74 @@ def get_base_categories() -> dict[int, CategorySchema]:
     return cats
 
 
+def load_json(rs) -> dict:
+    """Decode the body of a `requests` or `httpx` response."""
+    if settings.fast_parse:
+        return orjson.loads(rs.content)
+    return rs.json()
+
+
+def parse_category_info(data: dict) -> tuple[int, list[CategorySchema]]:
+    catalogs = [CategorySchema(**c) for c in data["data"]["catalogs"]["data"]]
+    product_cnt = data["data"]["products"]["count"]
+    return product_cnt, catalogs
+
+
 def get_category_info(s: HTTPSession, cat: CategorySchema) -> tuple[int, list[CategorySchema]]:
     log.info("getting info for %s ", cat)
     rs = s.get(settings.api(f"shop/catalog/{cat.id}"), params={"limit": 0, "page": 1})
     rs.raise_for_status()
-    data = rs.json()
-    catalogs = [CategorySchema(**c) for c in data["data"]["catalogs"]["data"]]
-    product_cnt = data["data"]["products"]["count"]
-    return product_cnt, catalogs
+    return parse_category_info(load_json(rs))
+
+
+def catalog_params(limit: int, page: int) -> dict:
+    return {"limit": limit, "page": page, "sort[mock]": ""}
+
+
+def parse_catalog_products(data: dict, catalog_id: int, limit: int, page: int) -> list[ProductSchema]:
+    with metrics.timer("page_parse_duration_seconds"):
+        if settings.fast_parse:
+            offset = (page - 1) * limit
+            # the catalog id is overwritten to the catalog that we found the product in
+            pss = product_page_adapter.validate_python(
+                [
+                    {**p, "sortPos": offset + i + 1, "catalogId": catalog_id}
+                    for i, p in enumerate(data["data"]["products"]["data"])
+                ]
+            )
+        else:
+            pss = []
+            for i, p in enumerate(data["data"]["products"]["data"]):
+                sort_pos = i + 1 + ((page - 1) * limit)
+                ps = ProductSchema(sort_pos=sort_pos, **p)
+                ps.catalog_id = catalog_id  # overwrite to the catalog that we found the product in
+                pss.append(ps)
+    metrics.inc("pages_parsed_total")
+    metrics.inc("products_parsed_total", len(pss))
+    return pss
 
 
 def get_catalog_products(s: HTTPSession, cat: Category, limit: int = 40, page: int = 1) -> list[ProductSchema]:
     log.info("getting %r products, page %d of size %d", cat.name, page, limit)
-    rs = s.get(settings.api(f"shop/catalog/{cat.id}"), params={"limit": limit, "page": page, "sort[mock]": ""})
+    rs = s.get(settings.api(f"shop/catalog/{cat.id}"), params=catalog_params(limit, page))
     rs.raise_for_status()
-    data = rs.json()
-    pss = []
-    for i, p in enumerate(data["data"]["products"]["data"]):
-        sort_pos = i + 1 + ((page - 1) * limit)
-        ps = ProductSchema(sort_pos=sort_pos, **p)
-        ps.catalog_id = cat.id  # overwrite to the catalog that we found the product in
-        pss.append(ps)
-    return pss
+    return parse_catalog_products(load_json(rs), cat.id, limit, page)
 
 
-def import_category(s: SessionClass, cs: CategorySchema) -> Category:
+def import_category(s: SessionClass, cs: CategorySchema, registry: "ImportRegistry") -> Category:
     parent_cat = None
     if cs.parent_id:
-        parent_cs = get_base_categories()[cs.parent_id]
-        parent_cat = import_category(s, parent_cs)
+        # ancestors already seen in this run are neither looked up nor re-imported
+        parent_cat = registry.categories.get(cs.parent_id)
+        if parent_cat is None:
+            parent_cs = get_base_categories()[cs.parent_id]
+            parent_cat = import_category(s, parent_cs, registry)
 
-    cat = s.scalar(select(Category).where(Category.id == cs.id))
+    cat = registry.categories.get(cs.id)
     if not cat:
         log.info("creating %s", cs)
         cat = Category(id=cs.id, name=cs.name, uri=cs.uri, parent=parent_cat)
+        registry.categories[cs.id] = cat
     else:
         log.info("updating %s", cs)
         cat.name = cs.name
@@ -117,9 +206,105 @@ def import_category(s: SessionClass, cs: CategorySchema) -> Category:
         cat.parent = parent_cat
 
     s.add(cat)
+    metrics.inc("rows_written_total", table="category")
     return cat
 
 
+def upsert_categories(s: SessionClass, css: list[CategorySchema], product_counts: dict[int, int]) -> None:
+    """
+    Set-based counterpart of `import_category` for a whole discovered tree.
+
+    Parents must go before their children.
+    """
+    if not css:
+        return
+    stmt = insert(Category)
+    rs = s.execute(
+        stmt.on_conflict_do_update(
+            index_elements=[Category.id],
+            set_={
+                "name": stmt.excluded.name,
+                "uri": stmt.excluded.uri,
+                "parent_id": stmt.excluded.parent_id,
+                "product_count": stmt.excluded.product_count,
+            },
+        ),
+        [
+            {
+                "id": cs.id,
+                "name": cs.name,
+                "uri": cs.uri,
+                "parent_id": cs.parent_id,
+                "product_count": product_counts.get(cs.id),
+            }
+            for cs in css
+        ],
+    )
+    metrics.inc("rows_written_total", max(rs.rowcount, 0), table="category")
+    log.info("upserted %d categories", len(css))
+
+
+def refresh_category_paths(s: SessionClass) -> list[int]:
+    """Materialize `Category.text_embedding` of every category into its path with one statement, return changed ids."""
+    changed = (
+        s.execute(
+            text(
+                "WITH RECURSIVE tree (id, path) AS ("
+                "SELECT id, name::text FROM category WHERE parent_id IS NULL "
+                "UNION ALL "
+                "SELECT c.id, tree.path || ' > ' || c.name FROM category c JOIN tree ON c.parent_id = tree.id"
+                ") "
+                "UPDATE category SET path = tree.path FROM tree "
+                "WHERE category.id = tree.id AND category.path IS DISTINCT FROM tree.path "
+                "RETURNING category.id"
+            )
+        )
+        .scalars()
+        .all()
+    )
+    log.info("paths of %d categories refreshed", len(changed))
+    return changed
+
+
+def refresh_search_vectors(
+    s: SessionClass, product_ids: Collection[int] | None = None, category_ids: Collection[int] | None = None
+) -> int:
+    """
+    Recompute `Product.search_vector` from names, brands and category paths.
+
+    Only of the given products, or of the products in the given categories, of the whole catalog without either.
+    """
+    if product_ids is not None:
+        where, ids = "WHERE p.id = ANY(:ids) ", product_ids
+    elif category_ids is not None:
+        where = "WHERE p.id IN (SELECT product_id FROM product_category WHERE category_id = ANY(:ids)) "
+        ids = category_ids
+    else:
+        where, ids = "", ()
+    if where and not ids:
+        return 0
+    rs = s.execute(
+        text(
+            "WITH v AS ("
+            "SELECT p.id, "
+            "setweight(to_tsvector('russian', coalesce(p.name, '')), 'A') || "
+            "setweight(to_tsvector('russian', coalesce(p.brand_name, '')), 'B') || "
+            "setweight(to_tsvector('russian', coalesce(string_agg(c.path, ' '), '')), 'C') AS search_vector "
+            "FROM product p "
+            "LEFT JOIN product_category pc ON pc.product_id = p.id "
+            "LEFT JOIN category c ON c.id = pc.category_id "
+            f"{where}"
+            "GROUP BY p.id"
+            ") "
+            "UPDATE product SET search_vector = v.search_vector FROM v "
+            "WHERE product.id = v.id AND product.search_vector IS DISTINCT FROM v.search_vector"
+        ),
+        {"ids": list(ids)},
+    )
+    log.info("search vectors of %d products refreshed", rs.rowcount)
+    return rs.rowcount
+
+
 def import_feature(s: SessionClass, pc: ProductCharacteristic) -> Feature:
     feat = s.scalar(select(Feature).where(Feature.id == pc.id))
     if not feat:
@@ -130,77 +315,131 @@ def import_feature(s: SessionClass, pc: ProductCharacteristic) -> Feature:
     return feat
 
 
+def product_values(ps: ProductSchema) -> dict:
+    """Column values of the `Product` row built from the schema."""
+    return {
+        "id": ps.id,
+        "name": ps.name,
+        "producer_country": ps.producer_country,
+        "brand_name": ps.brand_name,
+        "description": ps.description,
+        "image_url": str(ps.image),
+        "measure": ps.measure,
+        "is_weighted": ps.is_weighted,
+        "weight_avg": ps.weight_avg,
+        "weight_min": ps.weight_min,
+        "weight_max": ps.weight_max,
+        "weight": ps.weight,
+        "piece_weight_min": ps.piece_weight_min,
+        "piece_weight_max": ps.piece_weight_max,
+        "sell_by_piece": ps.sell_by_piece,
+        "quantity_min_step": ps.quantity_min_step,
+        "price_actual": ps.price_actual,
+        "price_special": ps.price_special,
+        "price_previous": ps.price_previous,
+        "is_available": ps.is_available,
+        "is_local": ps.is_local,
+        "nutrition_fats": ps.nutrition.fats if ps.nutrition else None,
+        "nutrition_protein": ps.nutrition.protein if ps.nutrition else None,
+        "nutrition_kcal": ps.nutrition.kcal if ps.nutrition else None,
+        "nutrition_carbs": ps.nutrition.carbs if ps.nutrition else None,
+        "ingredients": ps.ingredients,
+        "storage_conditions": ps.storage_conditions,
+        "information": ps.information,
+        "rating_value": ps.rating.value if ps.rating else None,
+        "rating_reviews": ps.rating.reviews if ps.rating else None,
+    }
+
+
+# refreshed on their own by app.crawler.prices
+PRICE_FIELDS = ("price_actual", "price_special", "price_previous", "is_available")
+
+
+def digest(payload: dict) -> str:
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, ensure_ascii=False).encode()).hexdigest()
+
+
+def price_hash(ps: ProductSchema | ProductPriceSchema) -> str:
+    return digest({name: getattr(ps, name) for name in PRICE_FIELDS})
+
+
+def product_hash(ps: ProductSchema) -> str:
+    """
+    Stable hash of everything the loader writes for a product, except its position in a category.
+
+    Prices and availability are hashed apart, as ``<content>:<prices>``, so the price refresh
+    can replace the second part along with them.
+    """
+    values = product_values(ps)
+    for name in PRICE_FIELDS:
+        del values[name]
+    content = digest({**values, "features": sorted((pc.id, pc.name) for pc in ps.characteristics)})
+    return f"{content}:{price_hash(ps)}"
+
+
+@dataclass
+class ImportStats:
+    inserted: set[int] = field(default_factory=set)
+    changed: set[int] = field(default_factory=set)
+    unchanged: set[int] = field(default_factory=set)
+    missing: set[int] = field(default_factory=set)  # not in the database, so not written by a price refresh
+
+    def update(self, other: "ImportStats"):
+        self.inserted |= other.inserted
+        self.changed |= other.changed - self.inserted
+        self.unchanged |= other.unchanged - self.inserted - self.changed
+        self.missing |= other.missing
+
+    def __str__(self):
+        summary = f"{len(self.inserted)} inserted, {len(self.changed)} changed, {len(self.unchanged)} unchanged"
+        return f"{summary}, {len(self.missing)} missing" if self.missing else summary
+
+
+@dataclass
+class ImportRegistry:
+    """
+    Per-run identity map of what the database already has, consulted by the loader instead of querying it.
+
+    Kept up to date by the loader as its writes commit.
+    """
+
+    features: dict[int, str] = field(default_factory=dict)
+    product_hashes: dict[int, str | None] = field(default_factory=dict)
+    categories: dict[int, Category] = field(default_factory=dict)
+
+    @classmethod
+    def for_products(cls, s: SessionClass) -> "ImportRegistry":
+        """Preload features and product hashes, one query each."""
+        return cls(
+            features=dict(s.execute(select(Feature.id, Feature.name)).tuples()),
+            product_hashes=dict(s.execute(select(Product.id, Product.content_hash)).tuples()),
+        )
+
+    @classmethod
+    def for_categories(cls, s: SessionClass) -> "ImportRegistry":
+        """Preload categories; the session must not expire them on commit."""
+        return cls(categories={cat.id: cat for cat in s.scalars(select(Category))})
+
+    def update(self, written: "ImportRegistry"):
+        """Take what a committed write added."""
+        self.features.update(written.features)
+        self.product_hashes.update(written.product_hashes)
+
+
 def import_product(s: SessionClass, ps: ProductSchema) -> Product:
     feats = [import_feature(s, pc) for pc in ps.characteristics]
     p: Product = s.scalar(select(Product).where(Product.id == ps.id))
+    content_hash = product_hash(ps)
 
     if not p:
         log.info("creating %s", ps)
-        p = Product(
-            id=ps.id,
-            name=ps.name,
-            producer_country=ps.producer_country,
-            brand_name=ps.brand_name,
-            description=ps.description,
-            image_url=str(ps.image),
-            measure=ps.measure,
-            is_weighted=ps.is_weighted,
-            weight_avg=ps.weight_avg,
-            weight_min=ps.weight_min,
-            weight_max=ps.weight_max,
-            weight=ps.weight,
-            piece_weight_min=ps.de,
-            piece_weight_max=ps.piece_weight_max,
-            sell_by_piece=ps.sell_by_piece,
-            quantity_min_step=ps.quantity_min_step,
-            price_actual=ps.price_actual,
-            price_special=ps.price_special,
-            price_previous=ps.price_previous,
-            is_available=ps.is_available,
-            is_local=ps.is_local,
-            nutrition_fats=ps.nutrition.fats if ps.nutrition else None,
-            nutrition_protein=ps.nutrition.protein if ps.nutrition else None,
-            nutrition_kcal=ps.nutrition.kcal if ps.nutrition else None,
-            nutrition_carbs=ps.nutrition.carbs if ps.nutrition else None,
-            ingredients=ps.ingredients,
-            storage_conditions=ps.storage_conditions,
-            features=feats,
-            information=ps.information,
-            rating_value=ps.rating.value if ps.rating else None,
-            rating_reviews=ps.rating.reviews if ps.rating else None,
-        )
-    else:
+        p = Product(**product_values(ps), content_hash=content_hash, features=feats)
+    elif p.content_hash != content_hash:
         log.debug("updating %s", ps)
         p.features.extend([feat for feat in feats if feat not in p.features])
-        p.name = ps.name
-        p.producer_country = ps.producer_country
-        p.brand_name = ps.brand_name
-        p.description = ps.description
-        p.image_url = str(ps.image)
-        p.measure = ps.measure
-        p.is_weighted = ps.is_weighted
-        p.weight_avg = ps.weight_avg
-        p.weight_min = ps.weight_min
-        p.weight_max = ps.weight_max
-        p.weight = ps.weight
-        p.piece_weight_min = ps.piece_weight_min
-        p.piece_weight_max = ps.piece_weight_max
-        p.sell_by_piece = ps.sell_by_piece
-        p.quantity_min_step = ps.quantity_min_step
-        p.price_actual = ps.price_actual
-        p.price_special = ps.price_special
-        p.price_previous = ps.price_previous
-        p.is_available = ps.is_available
-        p.is_local = ps.is_local
-        p.nutrition_fats = ps.nutrition.fats if ps.nutrition else None
-        p.nutrition_protein = ps.nutrition.protein if ps.nutrition else None
-        p.nutrition_kcal = ps.nutrition.kcal if ps.nutrition else None
-        p.nutrition_carbs = ps.nutrition.carbs if ps.nutrition else None
-        p.ingredients = ps.ingredients
-        p.storage_conditions = ps.storage_conditions
-        p.information = ps.information
-        p.rating_value = ps.rating.value if ps.rating else None
-        p.rating_reviews = ps.rating.reviews if ps.rating else None
+        for key, value in product_values(ps).items():
+            setattr(p, key, value)
+        p.content_hash = content_hash
         # mark product as updated
         p.updated_at = datetime.now(UTC)
     s.add(p)
@@ -219,43 +458,157 @@ def import_product(s: SessionClass, ps: ProductSchema) -> Product:
     return p
 
 
-def import_products(pss: list[ProductSchema]) -> list[Product]:
-    products = []
-    with Session() as s, s.begin():
-        for ps in pss:
-            p = import_product(s, ps)
-            products.append(p)
-    return products
-
+def upsert_products(
+    s: SessionClass, pss: list[ProductSchema], registry: ImportRegistry | None = None
+) -> tuple[ImportStats, ImportRegistry]:
+    """
+    Set-based counterpart of `import_product` for a whole page (or category) of products.
+
+    Writes features, products and their links with one ``INSERT ... ON CONFLICT`` statement per table.
+    Products whose content hash didn't change are not rewritten, so ``updated_at`` only moves on real changes.
+    Features of a product are only ever added, like `import_product` does.
+    Search vectors are refreshed for the new and changed products, and the ones that got into another category.
+    Without a registry, hashes of the products are looked up and every feature is upserted.
+    Returns what was written for the registry too, it's only updated by the caller once the transaction commits,
+    so a rollback doesn't leave products in it which later pages would skip as unchanged.
+    """
+    stats = ImportStats()
+    if not pss:
+        return stats, ImportRegistry()
+    now = datetime.now(UTC)
+    # a statement can't touch the same row twice, the latest occurrence wins
+    products = {ps.id: ps for ps in pss}
+    if registry is None:
+        registry = ImportRegistry(
+            product_hashes=dict(
+                s.execute(select(Product.id, Product.content_hash).where(Product.id.in_(products))).tuples()
+            )
+        )
+    hashes = {ps.id: product_hash(ps) for ps in products.values()}
+    for product_id, content_hash in hashes.items():
+        if product_id not in registry.product_hashes:
+            stats.inserted.add(product_id)
+        elif registry.product_hashes[product_id] != content_hash:
+            stats.changed.add(product_id)
+        else:
+            stats.unchanged.add(product_id)
+    dirty = [products[product_id] for product_id in hashes if product_id not in stats.unchanged]
+
+    features = {pc.id: pc.name for ps in dirty for pc in ps.characteristics if registry.features.get(pc.id) != pc.name}
+    if features:
+        stmt = insert(Feature)
+        rs = s.execute(
+            stmt.on_conflict_do_update(
+                index_elements=[Feature.id],
+                set_={"name": stmt.excluded.name},
+                where=Feature.name != stmt.excluded.name,
+            ),
+            [{"id": feat_id, "name": name} for feat_id, name in features.items()],
+        )
+        metrics.inc("rows_written_total", max(rs.rowcount, 0), table="feature")
+
+    if dirty:
+        stmt = insert(Product)
+        rows = [
+            {**product_values(ps), "content_hash": hashes[ps.id], "created_at": now, "updated_at": now} for ps in dirty
+        ]
+        rs = s.execute(
+            stmt.on_conflict_do_update(
+                index_elements=[Product.id],
+                set_={key: stmt.excluded[key] for key in rows[0] if key not in ("id", "created_at")},
+            ),
+            rows,
+        )
+        metrics.inc("rows_written_total", max(rs.rowcount, 0), table="product")
 
-def import_category_products(client: HTTPSession, cat: Category, s: SessionClass):
+    feature_links = {(ps.id, pc.id) for ps in dirty for pc in ps.characteristics}
+    if feature_links:
+        rs = s.execute(
+            insert(product_features).on_conflict_do_nothing(),
+            [{"product_id": product_id, "feature_id": feat_id} for product_id, feat_id in feature_links],
+        )
+        metrics.inc("rows_written_total", max(rs.rowcount, 0), table="product_features")
+
+    # pages written together can list a product twice if the listing shifted between their fetches
+    positions = {(ps.id, ps.catalog_id): ps.sort_pos for ps in pss}
+    stmt = insert(ProductCategory)
+    links = s.execute(
+        stmt.on_conflict_do_update(
+            index_elements=[ProductCategory.product_id, ProductCategory.category_id],
+            set_={"sort_pos": stmt.excluded.sort_pos},
+            where=ProductCategory.sort_pos != stmt.excluded.sort_pos,
+        ).returning(ProductCategory.product_id, literal_column("xmax = 0", Boolean)),  # inserted, not updated
+        [
+            {"product_id": product_id, "category_id": category_id, "sort_pos": sort_pos}
+            for (product_id, category_id), sort_pos in positions.items()
+        ],
+    ).all()
+    metrics.inc("rows_written_total", len(links), table="product_category")
+    linked = {product_id for product_id, inserted in links if inserted}
+    refresh_search_vectors(s, stats.inserted | stats.changed | linked)
+    log.info("upserted %d products: %s", len(products), stats)
+    return stats, ImportRegistry(features=features, product_hashes={ps.id: hashes[ps.id] for ps in dirty})
+
+
+def import_products(pss: list[ProductSchema], registry: ImportRegistry | None = None) -> ImportStats:
+    with metrics.timer("db_write_duration_seconds", op="products"), Session() as s, s.begin():
+        stats, written = upsert_products(s, pss, registry)
+    if registry is not None:
+        registry.update(written)
+    return stats
+
+
+def import_category_products(
+    client: HTTPSession,
+    cat: Category,
+    s: SessionClass,
+    run_id: int,
+    registry: ImportRegistry,
+    start_page: int = 1,
+):
     log.info("importing products of %r", cat.name)
-    page = 1
+    stats = ImportStats()
+    page = start_page
     while True:
         try:
             products = get_catalog_products(client, cat, limit=40, page=page)
         except HTTPError as e:
             if e.response.status_code == 404:
-                log.info("no products found for %r", cat.name)
-                return
+                # there are no (more) pages, the category is done with the ones imported
+                log.info("no more products found for %r", cat.name)
+                page -= 1
+                break
             else:
                 raise
 
-        import_products(products)
+        stats.update(import_products(products, registry))
         if len(products) < 40:
-            log.info("products imported for %r", cat.name)
+            log.info("products imported for %r: %s", cat.name, stats)
             break
+        save_checkpoint(s, run_id, cat.id, last_page=page)
+        s.commit()
         page += 1
-        time.sleep(4)
+        pause(4)
 
     cat.updated_at = datetime.now(UTC)
     s.add(cat)
+    save_checkpoint(s, run_id, cat.id, last_page=page, done=True)
     s.commit()
 
 
-def load_category(cs: CategorySchema, client: HTTPSession, s: SessionClass):
-    import_category(s, cs)
-    time.sleep(2)
+def load_category(
+    cs: CategorySchema,
+    client: HTTPSession,
+    s: SessionClass,
+    run_id: int,
+    done: set[int],
+    registry: ImportRegistry,
+):
+    if cs.id in done:
+        log.debug("%s is already loaded in this run", cs)
+        return
+    cat = import_category(s, cs, registry)
+    pause(2)
 
     # look deeper into the category
     try:
@@ -266,31 +619,53 @@ def load_category(cs: CategorySchema, client: HTTPSession, s: SessionClass):
             return
         else:
             raise
+    cat.product_count = cnt
     if sub_css:
         log.info("importing %d subcategories for %s", len(sub_css), cs.name)
     for sub_cs in sub_css:
-        load_category(sub_cs, client, s)
-    s.commit()
+        load_category(sub_cs, client, s, run_id, done, registry)
+    # the whole subtree is loaded now
+    save_checkpoint(s, run_id, cs.id, done=True)
+    with metrics.timer("db_write_duration_seconds", op="categories"):
+        s.commit()
 
 
 def load_categories() -> None:
     client = login()
     base_css = list(get_base_categories().values())
 
-    with Session() as s:
+    # categories of the registry stay loaded between commits
+    with run_report(CrawlKind.categories) as report, Session(expire_on_commit=False) as s:
+        run = start_run(s, CrawlKind.categories)
+        report.info["run_id"] = run.id
+        done = {cp.category_id for cp in get_progress(s, run.id).values() if cp.status == CrawlStatus.finished}
+        registry = ImportRegistry.for_categories(s)
         for base_cs in base_css:
-            load_category(base_cs, client, s)
+            load_category(base_cs, client, s, run.id, done, registry)
+        refresh_search_vectors(s, category_ids=refresh_category_paths(s))
+        finish_run(s, run.id)
+
+
+def get_leaf_categories(s: SessionClass) -> list[Category]:
+    # import products only for leaf categories,
+    # because it seems that branch categories don't have any products by themselves
+    return s.scalars(select(Category).where(~Category.children.any()).order_by(desc(Category.updated_at))).all()
 
 
 def load_products() -> None:
     client = login()
-    with Session() as s:
-        # import products only for leaf categories,
-        # because it seems that branch categories don't have any products by themselves
-        cats: list[Category] = s.scalars(
-            select(Category).where(~Category.children.any()).order_by(desc(Category.updated_at))
-        ).all()
+    with run_report(CrawlKind.products) as report, Session() as s:
+        run = start_run(s, CrawlKind.products)
+        report.info["run_id"] = run.id
+        progress = get_progress(s, run.id)
+        cats = get_leaf_categories(s)
+        registry = ImportRegistry.for_products(s)
         log.info("%d categories selected for an update", len(cats))
         for cat in cats:
-            time.sleep(2)
-            import_category_products(client, cat, s)
+            cp = progress.get(cat.id)
+            if cp and cp.status == CrawlStatus.finished:
+                log.debug("%r is already imported in this run", cat)
+                continue
+            pause(2)
+            import_category_products(client, cat, s, run.id, registry, start_page=cp.last_page + 1 if cp else 1)
+        finish_run(s, run.id)
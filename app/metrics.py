@@ -0,0 +1,179 @@
+import bisect
+import json
+import logging
+import re
+import threading
+import time
+from collections import defaultdict
+from collections.abc import Iterator
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from datetime import UTC, datetime
+from pathlib import Path
+from urllib.parse import urlsplit
+
+from app.config import settings
+from app.http_cache import write_atomic
+
+log = logging.getLogger(__name__)
+
+# seconds, good for page parsing, HTTP requests and database writes alike
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+Labels = tuple[tuple[str, str], ...]
+
+
+def endpoint(url: str) -> str:
+    """Path of an API URL (or of a request line) with the ids replaced, so every category counts as one endpoint."""
+    path = urlsplit(url).path.removeprefix(urlsplit(settings.api("")).path)
+    return re.sub(r"/\d+(?=/|$)", "/{id}", path) or "/"
+
+
+@dataclass
+class Histogram:
+    buckets: tuple[float, ...] = DEFAULT_BUCKETS
+    counts: list[int] = field(default_factory=lambda: [0] * (len(DEFAULT_BUCKETS) + 1))
+    sum: float = 0.0
+    count: int = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        """Upper bound of the bucket the quantile falls into."""
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts, strict=False):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+    def summary(self) -> dict:
+        return {
+            "count": self.count,
+            "sum": round(self.sum, 6),
+            "mean": round(self.sum / self.count, 6) if self.count else None,
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+            "p99": self.quantile(0.99),
+        }
+
+
+class Metrics:
+    """
+    Counters and histograms of a single loader run.
+
+    Metrics are identified by name and labels, the way Prometheus does it.
+    Safe to update from the worker threads of the crawler.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self, **info):
+        with self._lock:
+            self.info = info
+            self.started_at = datetime.now(UTC)
+            self.started = time.monotonic()
+            self.counters: dict[str, dict[Labels, float]] = defaultdict(lambda: defaultdict(float))
+            self.histograms: dict[str, dict[Labels, Histogram]] = defaultdict(dict)
+
+    def inc(self, name: str, value: float = 1, **labels):
+        with self._lock:
+            self.counters[name][tuple(sorted(labels.items()))] += value
+
+    def observe(self, name: str, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            histogram = self.histograms[name].get(key)
+            if histogram is None:
+                histogram = self.histograms[name][key] = Histogram()
+            histogram.observe(value)
+
+    @contextmanager
+    def timer(self, name: str, **labels) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    def report(self) -> dict:
+        elapsed = time.monotonic() - self.started
+        with self._lock:
+            return {
+                **self.info,
+                "started_at": self.started_at.isoformat(),
+                "elapsed": round(elapsed, 3),
+                "counters": {
+                    name: [
+                        {"labels": dict(key), "value": value, "per_second": value / elapsed}
+                        for key, value in series.items()
+                    ]
+                    for name, series in self.counters.items()
+                },
+                "histograms": {
+                    name: [{"labels": dict(key), **histogram.summary()} for key, histogram in series.items()]
+                    for name, series in self.histograms.items()
+                },
+            }
+
+    def to_prometheus(self, prefix: str = "arbuz_loader_") -> str:
+        """Text exposition format, for the textfile collector of node_exporter."""
+        lines = []
+        with self._lock:
+            # a label of its own for every run would make a new series of every run, it's left to the JSON report
+            run_labels = tuple(sorted((key, str(value)) for key, value in self.info.items() if key != "run_id"))
+            lines += [
+                f"# TYPE {prefix}run_duration_seconds gauge",
+                f"{prefix}run_duration_seconds{format_labels(run_labels)} {time.monotonic() - self.started}",
+            ]
+            for name, series in self.counters.items():
+                lines.append(f"# TYPE {prefix}{name} counter")
+                lines += [f"{prefix}{name}{format_labels(key)} {value}" for key, value in series.items()]
+            for name, series in self.histograms.items():
+                lines.append(f"# TYPE {prefix}{name} histogram")
+                for key, histogram in series.items():
+                    cumulative = 0
+                    for bound, count in zip((*histogram.buckets, "+Inf"), histogram.counts, strict=True):
+                        cumulative += count
+                        lines.append(f"{prefix}{name}_bucket{format_labels((*key, ('le', str(bound))))} {cumulative}")
+                    lines.append(f"{prefix}{name}_sum{format_labels(key)} {histogram.sum}")
+                    lines.append(f"{prefix}{name}_count{format_labels(key)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+
+def format_labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in labels) + "}"
+
+
+metrics = Metrics()
+
+
+def write_report(report_dir: Path, prometheus_file: Path | None = None) -> Path:
+    report = metrics.report()
+    path = report_dir / f"{report.get('kind', 'run')}-{metrics.started_at:%Y%m%dT%H%M%S}.json"
+    write_atomic(path, json.dumps(report, indent=2, default=str).encode())
+    log.info("run report written to %s", path)
+    if prometheus_file:
+        write_atomic(prometheus_file, metrics.to_prometheus().encode())
+    return path
+
+
+@contextmanager
+def run_report(kind: str) -> Iterator[Metrics]:
+    """Collect metrics of a loader run and write its report at the end, even if the run fails."""
+    metrics.reset(kind=kind)
+    status = "failed"
+    try:
+        yield metrics
+        status = "finished"
+    finally:
+        metrics.info["status"] = status
+        write_report(settings.report_dir, settings.report_prometheus_file)
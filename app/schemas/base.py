@@ -1,3 +1,4 @@
+from functools import lru_cache
 from typing import Any
 
 import html2text
@@ -8,6 +9,9 @@ def to_camel(string: str) -> str:
     return parts[0] + "".join(word.capitalize() for word in parts[1:])
 
 
+# storage conditions and information blocks repeat a lot across products.
+# the converter keeps the state of the document it has converted, so a new one is built for every call
+@lru_cache(maxsize=4096)
 def html_to_markdown(html_text: str) -> str:
     handler = html2text.HTML2Text()
     handler.ignore_links = False  # or True if you want to strip them
@@ -1,6 +1,6 @@
 from typing import Literal
 
-from pydantic import BaseModel, ConfigDict, HttpUrl, field_validator
+from pydantic import BaseModel, ConfigDict, HttpUrl, TypeAdapter, field_validator
 
 from .base import html_to_markdown, parse_comma_float, to_camel
 
@@ -97,3 +97,28 @@ class ProductSchema(BaseModel):
         if val:
             val = html_to_markdown(val)
         return val
+
+
+class SlimProductSchema(ProductSchema):
+    """`ProductSchema` that drops the fields it doesn't declare, instead of keeping the whole payload alive."""
+
+    model_config = ConfigDict(extra="ignore")
+
+
+# validates a whole page of products in one call
+product_page_adapter = TypeAdapter(list[SlimProductSchema])
+
+
+class ProductPriceSchema(BaseModel):
+    """Volatile fields of a product, refreshed much more often than the rest of it."""
+
+    model_config = ConfigDict(alias_generator=to_camel, populate_by_name=True)
+
+    id: int
+    price_actual: float
+    price_previous: int | None
+    price_special: int | None
+    is_available: bool
+
+
+price_page_adapter = TypeAdapter(list[ProductPriceSchema])
@@ -0,0 +1,249 @@
+"""
+Local stand-in of the Arbuz site and API, enough for the loader to run against it.
+
+    python -m benchmarks.arbuz_stub [--port 8080] [--latency 0.05] [--rate-429 0.02] [--recorded .cache/http]
+
+Serves the homepage (platform configuration and the catalog tree), ``auth/token`` and ``shop/catalog/{id}``.
+Payloads are synthetic, or replayed from a `app.http_cache.ResponseCache` recorded against the real site.
+Point the loader to it with ``ARBUZ_SITE_URL=http://127.0.0.1:8080/ ARBUZ_API_BASE=http://127.0.0.1:8080/api/v1/``.
+"""
+
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlsplit
+
+from app.http_cache import ResponseCache
+
+from .parse_catalog import synthetic_product
+
+API_PATH = "/api/v1/"
+RECORDED_SITE = "https://arbuz.kz"
+
+
+@dataclass
+class SyntheticCatalog:
+    """
+    Category tree of the given shape, with products in its leaves.
+
+    Base categories and their children are listed on the homepage, like the real site does,
+    the deeper levels are only found through the catalog API.
+    """
+
+    base: int = 4
+    children: int = 3
+    leaves: int = 3
+    products: int = 120  # per leaf
+    shared: float = 0.1  # share of products listed in two leaves
+    seed: int = 42
+    nodes: dict[int, list[int]] = field(default_factory=dict)  # children by category id
+    parents: dict[int, int | None] = field(default_factory=dict)
+
+    def __post_init__(self):
+        next_id = iter(range(1, 10**9))
+        for _ in range(self.base):
+            base_id = self.add(next(next_id), None)
+            for _ in range(self.children):
+                child_id = self.add(next(next_id), base_id)
+                for _ in range(self.leaves):
+                    self.add(next(next_id), child_id)
+        self.leaf_ids = {
+            cat_id: i for i, cat_id in enumerate(cat_id for cat_id, nodes in self.nodes.items() if not nodes)
+        }
+
+    def add(self, cat_id: int, parent_id: int | None) -> int:
+        self.nodes[cat_id] = []
+        self.parents[cat_id] = parent_id
+        if parent_id is not None:
+            self.nodes[parent_id].append(cat_id)
+        return cat_id
+
+    def category(self, cat_id: int) -> dict:
+        return {"id": cat_id, "name": f"Категория {cat_id}", "uri": f"/ru/almaty/catalog/cat/{cat_id}"}
+
+    def homepage(self) -> str:
+        tree = {
+            str(i): {
+                **self.category(base_id),
+                "children": {str(j): self.category(child_id) for j, child_id in enumerate(self.nodes[base_id])},
+            }
+            for i, base_id in enumerate(cat_id for cat_id, parent in self.parents.items() if parent is None)
+        }
+        conf = {"consumer": {"desktop": {"name": "stub", "key": "stub"}}}
+        return (
+            "<html><script>"
+            f"window.platformConfiguration = {json.dumps(conf)};\n"
+            f"window.siteCatalogTree = Object.values({json.dumps(tree, ensure_ascii=False)});\n"
+            "</script></html>"
+        )
+
+    def product_ids(self, cat_id: int) -> list[int]:
+        if self.nodes.get(cat_id):
+            return []
+        index = self.leaf_ids[cat_id]
+        shared = int(self.products * self.shared)
+        previous = (index - 1) % len(self.leaf_ids)
+        # the first products of the previous leaf are listed here too
+        own = range(index * self.products, (index + 1) * self.products - shared)
+        return [*own, *range(previous * self.products, previous * self.products + shared)]
+
+    def catalog_page(self, cat_id: int, limit: int, page: int) -> dict | None:
+        if cat_id not in self.nodes:
+            return None
+        ids = self.product_ids(cat_id)
+        page_ids = ids[(page - 1) * limit : page * limit] if limit else []
+        return {
+            "data": {
+                "catalogs": {"data": [self.category(child_id) for child_id in self.nodes[cat_id]]},
+                "products": {
+                    "count": len(ids),
+                    # seeded by the id, so a product looks the same in every category and every run
+                    "data": [synthetic_product(random.Random(self.seed * 10**9 + i), i) for i in page_ids],
+                },
+            }
+        }
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    server: "ArbuzStub"
+
+    def log_message(self, *_args):
+        pass
+
+    def send_body(self, status: int, body: bytes, content_type: str = "application/json", headers: dict | None = None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def throttled(self) -> bool:
+        self.server.count_request()
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        if self.server.rnd.random() < self.server.rate_429:
+            self.server.count_request(throttled=True)
+            self.send_body(429, b'{"message": "Too Many Requests"}', headers={"Retry-After": "0"})
+            return True
+        return False
+
+    def do_POST(self):  # noqa: N802
+        if self.throttled():
+            return
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.path.startswith(f"{API_PATH}auth/token"):
+            self.send_body(200, b'{"data": {"token": "stub"}}')
+        else:
+            self.send_body(404, b"{}")
+
+    def do_GET(self):  # noqa: N802
+        if self.throttled():
+            return
+        if self.server.recorded:
+            self.replay()
+            return
+        parts = urlsplit(self.path)
+        if parts.path == "/":
+            self.send_body(200, self.server.catalog.homepage().encode(), content_type="text/html; charset=utf-8")
+            return
+        match = re.fullmatch(rf"{API_PATH}shop/catalog/(\d+)", parts.path)
+        query = parse_qs(parts.query)
+        data = match and self.server.catalog.catalog_page(
+            int(match[1]), int(query.get("limit", ["40"])[0]), int(query.get("page", ["1"])[0])
+        )
+        if not data:
+            self.send_body(404, b'{"message": "Not Found"}')
+            return
+        self.send_body(200, json.dumps(data, ensure_ascii=False).encode())
+
+    def replay(self):
+        cached = self.server.recorded.get(RECORDED_SITE + self.path)
+        if not cached:
+            self.send_body(404, b'{"message": "Not recorded"}')
+            return
+        self.send_body(cached.status, cached.body, content_type=cached.headers.get("content-type", "application/json"))
+
+
+class ArbuzStub(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(
+        self,
+        address: tuple[str, int] = ("127.0.0.1", 0),
+        catalog: SyntheticCatalog | None = None,
+        recorded: ResponseCache | None = None,
+        latency: float = 0.0,
+        rate_429: float = 0.0,
+    ):
+        super().__init__(address, StubHandler)
+        self.catalog = catalog or SyntheticCatalog()
+        self.recorded = recorded
+        self.latency = latency
+        self.rate_429 = rate_429
+        self.rnd = random.Random(0)
+        self.requests = 0
+        self.throttled = 0
+        self._lock = threading.Lock()
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/"
+
+    def count_request(self, throttled: bool = False):
+        with self._lock:
+            if throttled:
+                self.throttled += 1
+            else:
+                self.requests += 1
+
+    def start(self) -> "ArbuzStub":
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    group = parser.add_argument_group("API stand-in")
+    group.add_argument("--base", type=int, default=4, help="base categories")
+    group.add_argument("--children", type=int, default=3, help="children of a base category")
+    group.add_argument("--leaves", type=int, default=3, help="leaves of a child category")
+    group.add_argument("--products", type=int, default=120, help="products of a leaf category")
+    group.add_argument("--shared", type=float, default=0.1, help="share of products listed in two leaves")
+    group.add_argument("--latency", type=float, default=0.0, help="seconds added to every response")
+    group.add_argument("--rate-429", type=float, default=0.0, help="share of requests answered with 429")
+    group.add_argument("--recorded", type=Path, help="serve responses recorded by the HTTP cache instead")
+
+
+def stub_from_args(args: argparse.Namespace, port: int = 0) -> ArbuzStub:
+    catalog = SyntheticCatalog(
+        base=args.base, children=args.children, leaves=args.leaves, products=args.products, shared=args.shared
+    )
+    return ArbuzStub(
+        ("127.0.0.1", port),
+        catalog=catalog,
+        recorded=ResponseCache(args.recorded) if args.recorded else None,
+        latency=args.latency,
+        rate_429=args.rate_429,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=8080)
+    add_arguments(parser)
+    args = parser.parse_args()
+    stub = stub_from_args(args, args.port)
+    print(f"serving {len(stub.catalog.nodes)} categories at {stub.url}")
+    stub.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+"""
+End-to-end loader benchmark against the local API stand-in and a throwaway database.
+
+    python -m benchmarks.loader [--mode concurrent] [--repeat 2] [--prices] [--latency 0.05] [--rate-429 0.02]
+
+A database is created next to the one of ``POSTGRES_URL`` (or ``--postgres-url``), migrated to the head
+and dropped at the end. Categories and products are loaded from `benchmarks.arbuz_stub` with either
+the sequential loader (`app.loader`) or the concurrent one (`app.crawler`). Every repeat after the first one
+re-crawls the same catalog, which is what a daily update mostly looks like.
+Reports categories/s, products/s, HTTP requests and SQL statements issued per phase.
+"""
+
+import argparse
+import tempfile
+import time
+import uuid
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager
+from pathlib import Path
+
+from alembic.config import Config
+from pydantic import HttpUrl, PostgresDsn
+from sqlalchemy import create_engine, event, func, make_url, select, text
+from sqlalchemy.engine import Engine
+
+from alembic import command
+from app.config import settings
+from app.crawler import load_categories_concurrently, load_products_concurrently, refresh_prices
+from app.db import Session
+from app.db.models import Category, Product
+from app.loader import load_categories, load_products
+
+from .arbuz_stub import ArbuzStub, add_arguments, stub_from_args
+
+ROOT = Path(__file__).parent.parent
+LOADERS: dict[str, tuple[Callable[[], None], Callable[[], None]]] = {
+    "sequential": (load_categories, load_products),
+    "concurrent": (load_categories_concurrently, load_products_concurrently),
+}
+
+
+@contextmanager
+def throwaway_database(server_url: str) -> Iterator[str]:
+    """Create a database on the server of the given URL, yield its URL and drop it afterwards."""
+    url = make_url(server_url)
+    name = f"arbuz_bench_{uuid.uuid4().hex[:8]}"
+    admin = create_engine(url, isolation_level="AUTOCOMMIT")
+    with admin.connect() as conn:
+        conn.execute(text(f'CREATE DATABASE "{name}"'))
+    db_url = url.set(database=name).render_as_string(hide_password=False)
+    try:
+        engine = create_engine(db_url)
+        with engine.begin() as conn:
+            conn.execute(text("CREATE EXTENSION IF NOT EXISTS vchord CASCADE"))
+        engine.dispose()
+        yield db_url
+    finally:
+        with admin.connect() as conn:
+            conn.execute(text(f'DROP DATABASE IF EXISTS "{name}" WITH (FORCE)'))
+        admin.dispose()
+
+
+def migrate(db_url: str):
+    # alembic/env.py takes the URL from the settings
+    settings.postgres_url = PostgresDsn(db_url)
+    config = Config(ROOT / "alembic.ini")
+    config.set_main_option("script_location", str(ROOT / "alembic"))
+    command.upgrade(config, "head")
+
+
+class QueryCounter:
+    def __init__(self, engine: Engine):
+        self.count = 0
+        event.listen(engine, "before_cursor_execute", self.before_cursor_execute)
+
+    def before_cursor_execute(self, *_args):
+        self.count += 1
+
+
+def count_rows(model) -> int:
+    with Session() as s:
+        return s.scalar(select(func.count()).select_from(model))
+
+
+def measure(name: str, fn: Callable[[], None], stub: ArbuzStub, queries: QueryCounter) -> dict:
+    before = count_rows(Category), count_rows(Product)
+    requests, throttled, statements = stub.requests, stub.throttled, queries.count
+    started = time.perf_counter()
+    fn()
+    elapsed = time.perf_counter() - started
+    categories, products = count_rows(Category), count_rows(Product)
+    return {
+        "phase": name,
+        "elapsed": elapsed,
+        # everything in the database went through the loader, as it starts empty
+        "per_second": (categories if name == "categories" else products) / elapsed,
+        "new_categories": categories - before[0],
+        "new_products": products - before[1],
+        "requests": stub.requests - requests,
+        "throttled": stub.throttled - throttled,
+        "queries": queries.count - statements,
+    }
+
+
+def print_result(run: int, result: dict):
+    unit = "categories" if result["phase"] == "categories" else "products"
+    print(
+        f"run {run} {result['phase']:>10}: {result['elapsed']:7.2f}s, {result['per_second']:8.1f} {unit}/s, "
+        f"{result['requests']:5d} requests ({result['throttled']} throttled), {result['queries']:6d} queries, "
+        f"+{result['new_categories']} categories, +{result['new_products']} products"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--mode", choices=LOADERS, default="concurrent")
+    parser.add_argument("--repeat", type=int, default=2, help="crawls of the same catalog")
+    parser.add_argument("--prices", action="store_true", help="also refresh prices after every crawl")
+    parser.add_argument("--postgres-url", default=str(settings.postgres_url), help="server to create the database on")
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    stub = stub_from_args(args).start()
+    settings.arbuz_site_url = HttpUrl(stub.url)
+    settings.arbuz_api_base = HttpUrl(f"{stub.url}api/v1/")
+    settings.http_cache = "off"
+    settings.crawl_pauses = False
+    settings.crawl_resume = False
+    settings.crawl_rate = float("inf")
+    settings.report_dir = Path(tempfile.mkdtemp(prefix="arbuz-bench-"))
+    load_categories_fn, load_products_fn = LOADERS[args.mode]
+    phases = [("categories", load_categories_fn), ("products", load_products_fn)]
+    if args.prices:
+        phases.append(("prices", refresh_prices))
+
+    with throwaway_database(args.postgres_url) as db_url:
+        migrate(db_url)
+        engine = create_engine(db_url)
+        Session.configure(bind=engine)
+        queries = QueryCounter(engine)
+        source = f"recorded responses of {args.recorded}" if args.recorded else f"{len(stub.catalog.nodes)} categories"
+        print(f"{args.mode} loader, {source}")
+        for run in range(1, args.repeat + 1):
+            for name, fn in phases:
+                print_result(run, measure(name, fn, stub, queries))
+        engine.dispose()
+    stub.shutdown()
+    print(f"run reports: {settings.report_dir}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+"""
+Micro-benchmark of catalog page parsing: decoding the response and validating its products.
+
+    python -m benchmarks.parse_catalog [--pages 200] [--page-size 40] [--sample page.json]
+
+Compares the legacy path (stdlib json, a model per product, no HTML memoization, all extras kept)
+with the fast one (``settings.fast_parse``). Synthetic pages repeat HTML fragments the way
+the real catalog does; a recorded ``shop/catalog/{id}`` response can be given with ``--sample``.
+"""
+
+import argparse
+import json
+import random
+import time
+from unittest import mock
+
+import orjson
+
+from app.config import settings
+from app.loader import parse_catalog_products
+from app.schemas.base import html_to_markdown
+
+STORAGE_CONDITIONS = [
+    "<p>Хранить при температуре от <b>+2°C</b> до <b>+6°C</b></p>",
+    "<p>Хранить в сухом прохладном месте, вдали от прямых солнечных лучей.</p>",
+    "<p>После вскрытия хранить в холодильнике не более <b>3 суток</b>.</p>",
+    "<ul><li>Температура: -18°C</li><li>Повторная заморозка не допускается</li></ul>",
+]
+INFORMATION = [
+    "<p>Фото товара может отличаться от полученного. Вес может отличаться на <b>10%</b>.</p>",
+    "<p>Срок годности указан на упаковке. <a href='https://arbuz.kz/help'>Подробнее</a></p>",
+    "",
+]
+
+
+def synthetic_product(rnd: random.Random, product_id: int) -> dict:
+    return {
+        "id": product_id,
+        "brandName": rnd.choice([None, "Простоквашино", "Food Master", "Arbuz Select"]),
+        "catalogId": 1,
+        "characteristics": [{"id": rnd.randint(1, 300), "name": "Без глютена"} for _ in range(rnd.randint(0, 3))],
+        "description": "",
+        "discount": "",
+        "image": f"https://arbuz.kz/image/s3/arbuz-kz-products/{product_id}.jpg",
+        "information": rnd.choice(INFORMATION),
+        "ingredients": f"<p>молоко нормализованное, закваска {product_id % 17}</p>",
+        "isAvailable": rnd.random() > 0.1,
+        "isExpressAvailable": False,
+        "isLocal": rnd.random() > 0.5,
+        "isMain": False,
+        "isNew": False,
+        "isPromotional": False,
+        "isRecommended": False,
+        "isVerified": True,
+        "isWeighted": False,
+        "measure": "шт",
+        "name": f"Молоко {product_id} 2.5% 1 л",
+        "nutrition": {"carbs": "4,7", "fats": "2,5", "protein": "2,9", "kcal": "53"},
+        "parentCatalogId": None,
+        "pieceWeightMax": 1.0,
+        "pieceWeightMin": 1.0,
+        "priceActual": rnd.randint(300, 3000),
+        "pricePrevious": None,
+        "priceSpecial": None,
+        "producerCountry": "Казахстан",
+        "quantityExpress": 10,
+        "quantityMinStep": 1,
+        "rating": {"reviews": f"{rnd.randint(1, 500)} оценок", "value": "4,8"},
+        "sellByPiece": True,
+        "storageConditions": rnd.choice(STORAGE_CONDITIONS),
+        "uri": f"/ru/almaty/catalog/item/{product_id}",
+        "weight": "1 л",
+        "weightAvg": 1.0,
+        "weightMax": 1.0,
+        "weightMin": 1.0,
+        # a taste of the fields the loader doesn't use
+        "promo": {"label": "Выгодно", "colors": ["#fff", "#000"], "rules": [{"min": 1, "max": 10}] * 5},
+        "images": [f"https://arbuz.kz/image/{product_id}-{i}.jpg" for i in range(5)],
+    }
+
+
+def synthetic_pages(pages: int, page_size: int) -> list[bytes]:
+    rnd = random.Random(42)
+    bodies = []
+    for page in range(pages):
+        products = [synthetic_product(rnd, page * page_size + i) for i in range(page_size)]
+        bodies.append(json.dumps({"data": {"products": {"count": pages * page_size, "data": products}}}).encode())
+    return bodies
+
+
+def run(bodies: list[bytes], page_size: int, fast: bool) -> float:
+    """Parse all pages, return pages per second."""
+    settings.fast_parse = fast
+    html_to_markdown.cache_clear()
+    decode = orjson.loads if fast else json.loads
+    started = time.perf_counter()
+    for page, body in enumerate(bodies, start=1):
+        parse_catalog_products(decode(body), catalog_id=1, limit=page_size, page=page)
+    return len(bodies) / (time.perf_counter() - started)
+
+
+def legacy_html():
+    """Convert HTML without memoization, like before."""
+    return mock.patch("app.schemas.product.html_to_markdown", html_to_markdown.__wrapped__)
+
+
+def check_same_output(body: bytes, page_size: int):
+    settings.fast_parse = False
+    with legacy_html():
+        before = parse_catalog_products(json.loads(body), 1, page_size, 1)
+    settings.fast_parse = True
+    after = parse_catalog_products(json.loads(body), 1, page_size, 1)
+    fields = set(type(before[0]).model_fields)
+    assert [p.model_dump(include=fields) for p in before] == [p.model_dump(include=fields) for p in after]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pages", type=int, default=200)
+    parser.add_argument("--page-size", type=int, default=40)
+    parser.add_argument("--sample", help="recorded shop/catalog/{id} response, repeated --pages times")
+    args = parser.parse_args()
+
+    if args.sample:
+        with open(args.sample, "rb") as f:
+            bodies = [f.read()] * args.pages
+        args.page_size = len(json.loads(bodies[0])["data"]["products"]["data"])
+    else:
+        bodies = synthetic_pages(args.pages, args.page_size)
+
+    check_same_output(bodies[0], args.page_size)
+    with legacy_html():
+        before = run(bodies, args.page_size, fast=False)
+    after = run(bodies, args.page_size, fast=True)
+    products = args.page_size
+    print(f"legacy: {before:8.1f} pages/s ({before * products:9.0f} products/s)")
+    print(f"fast:   {after:8.1f} pages/s ({after * products:9.0f} products/s)")
+    print(f"speedup: x{after / before:.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+Latency of the productologist's vector search, with query vectors bound in binary or spelled out in the SQL,
+and of the in-process index of `app.gpt.product_index`.
+
+    python -m benchmarks.search [--calls 200] [--sub-queries 8] [--limit 20]
+
+Runs against the database of ``POSTGRES_URL``, which needs embeddings (`app.embedder`). The queries of
+`benchmarks.vector_recall` are embedded once, every call searches a random sample of them, the way a tool call
+of the agent does. Reports wall and client CPU time per call, and the size of the SQL sent.
+"""
+
+import argparse
+import random
+import statistics
+import time
+from collections.abc import Callable
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session as SessionClass
+
+from app.config import settings
+from app.db import Session
+from app.db.vector_index import set_search_parameters
+from app.gpt.embeddings import get_embeddings
+from app.gpt.product_index import ProductIndex
+from app.gpt.productologist import SEARCH_SQL, search_vectors
+
+from .vector_recall import QUERIES
+
+
+def format_vector(vector: list[float]) -> str:
+    return f"'[{', '.join(str(x) for x in vector)}]'"
+
+
+def literal_sql(vectors: list[list[float]]) -> str:
+    array = f"ARRAY[{', '.join(format_vector(vector) for vector in vectors)}]::{settings.embedding_storage}[]"
+    return SEARCH_SQL.replace("%(vectors)b", array).replace("%(limit)s", ":limit")
+
+
+def literal_search(session: SessionClass, vectors: list[list[float]], limit: int):
+    """The search as it was, a statement of its own for every set of vectors."""
+    session.execute(text(literal_sql(vectors)), {"limit": limit}).all()
+
+
+def measure(search: Callable, vectors: list[list[float]], calls: int, sub_queries: int, limit: int) -> dict:
+    rnd = random.Random(0)
+    wall, cpu = [], []
+    for _ in range(calls):
+        sample = rnd.sample(vectors, sub_queries)
+        with Session() as s:
+            set_search_parameters(s)
+            started, started_cpu = time.perf_counter(), time.process_time()
+            search(s, sample, limit)
+            wall.append(time.perf_counter() - started)
+            cpu.append(time.process_time() - started_cpu)
+    percentiles = statistics.quantiles(wall, n=20)
+    return {"p50": statistics.median(wall), "p95": percentiles[18], "cpu": statistics.mean(cpu)}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--calls", type=int, default=200, help="searches per mode")
+    parser.add_argument("--sub-queries", type=int, default=8, help="query vectors per search")
+    parser.add_argument("--limit", type=int, default=20, help="results per query vector")
+    parser.add_argument("--quantized", action="store_true", help="scan int8 vectors in the in-process index")
+    args = parser.parse_args()
+
+    vectors = get_embeddings(QUERIES)
+    sub_queries = min(args.sub_queries, len(vectors))
+    sql_sizes = {
+        "literal": len(literal_sql(vectors[:sub_queries]).encode()),
+        "bound": len(SEARCH_SQL.encode()),
+        "memory": 0,
+    }
+    print(f"{args.calls} searches of {sub_queries} vectors, {args.limit} results each")
+    index = ProductIndex(quantized=args.quantized)
+    started = time.perf_counter()
+    index.refresh()
+    print(f"{len(index)} embeddings loaded into the in-process index in {time.perf_counter() - started:.1f}s")
+    searches = {
+        "literal": literal_search,
+        "bound": search_vectors,
+        "memory": lambda _session, vectors, limit: index.search(vectors, limit),
+    }
+    for mode, search in searches.items():
+        result = measure(search, vectors, args.calls, sub_queries, args.limit)
+        print(
+            f"{mode:>8}: p50 {result['p50'] * 1000:7.2f}ms, p95 {result['p95'] * 1000:7.2f}ms, "
+            f"client CPU {result['cpu'] * 1000:6.2f}ms per search, {sql_sizes[mode]} bytes of SQL"
+        )
+
+
+if __name__ == "__main__":
+    main()
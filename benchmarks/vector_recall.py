@@ -0,0 +1,129 @@
+"""
+Search quality of cheaper embedding storage, compared with the full precision vectors of the database.
+
+    python -m benchmarks.vector_recall [--queries queries.txt] [--k 10] [--dims 1536,1024,768,512,256]
+
+Stored vectors of the available products and the embedded queries are cut to every dimension, normalized back
+and rounded to half precision, the way `embedding_dimension` and ``embedding_storage = "halfvec"`` store them.
+Reports recall@k of the exact cosine search against the one over the stored vectors, with the bytes a vector
+takes, to pick the cheapest setting that keeps quality. Run it before switching, on the full precision column.
+"""
+
+import argparse
+import time
+from pathlib import Path
+
+import numpy as np
+from pgvector.sqlalchemy import VECTOR
+from sqlalchemy import cast, select
+
+from app.db import Session
+from app.db.models import Product, ProductEmbedding
+from app.gpt.providers import get_provider
+
+# what the productologist asks for, more or less
+QUERIES = [
+    "молоко 3.2%",
+    "кефир",
+    "творог 5%",
+    "сыр твердый",
+    "сливочное масло",
+    "яйца куриные",
+    "хлеб ржаной",
+    "батон нарезной",
+    "гречка",
+    "рис длиннозерный",
+    "макароны спагетти",
+    "овсяные хлопья",
+    "куриное филе",
+    "говядина для борща",
+    "фарш свиной",
+    "лосось охлажденный",
+    "свекла",
+    "капуста белокочанная",
+    "картофель",
+    "морковь",
+    "лук репчатый",
+    "томатная паста",
+    "бананы",
+    "яблоки зеленые",
+    "апельсиновый сок",
+    "минеральная вода без газа",
+    "кофе молотый",
+    "чай черный",
+    "шоколад горький",
+    "подсолнечное масло",
+    "сметана 20%",
+    "без глютена",
+    "низкокалорийный йогурт",
+    "детское питание",
+    "корм для кошек",
+]
+# values of the storage types, a stored vector also has a header of 8 bytes
+DTYPES = {"vector": np.float32, "halfvec": np.float16}
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(norms, norms, 1)
+
+
+def load_vectors() -> np.ndarray:
+    with Session() as s:
+        rows = s.scalars(
+            select(cast(ProductEmbedding.vector, VECTOR()))
+            .join(ProductEmbedding.product)
+            .where(Product.is_available)
+            .order_by(ProductEmbedding.product_id)
+        ).all()
+    return np.array(rows, dtype=np.float32)
+
+
+def reduce(vectors: np.ndarray, dim: int, storage: str) -> np.ndarray:
+    """Vectors as stored with the dimension and storage, back in float32 to compute with."""
+    return normalize(vectors[:, :dim]).astype(DTYPES[storage]).astype(np.float32)
+
+
+def top_k(products: np.ndarray, queries: np.ndarray, k: int) -> np.ndarray:
+    # cosine distance of normalized vectors orders like the negated dot product, pgvector normalizes itself
+    scores = normalize(queries) @ normalize(products).T
+    best = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    return np.take_along_axis(best, np.argsort(-np.take_along_axis(scores, best, axis=1), axis=1), axis=1)
+
+
+def recall(found: np.ndarray, truth: np.ndarray) -> float:
+    k = truth.shape[1]
+    return float(np.mean([len(set(f) & set(t)) / k for f, t in zip(found, truth, strict=True)]))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--queries", type=Path, help="file with a query per line, instead of the built-in ones")
+    parser.add_argument("--k", type=int, default=10, help="results per query")
+    parser.add_argument("--dims", default="1536,1024,768,512,256", help="dimensions to compare, comma separated")
+    args = parser.parse_args()
+
+    queries = QUERIES
+    if args.queries:
+        queries = [line.strip() for line in args.queries.read_text().splitlines() if line.strip()]
+    started = time.perf_counter()
+    products = load_vectors()
+    if not len(products):
+        raise SystemExit("no embeddings of available products, run app.embedder first")
+    full = products.shape[1]
+    print(f"{len(products)} vectors of {full} dimensions loaded in {time.perf_counter() - started:.1f}s")
+    k = min(args.k, len(products))
+    # provider vectors aren't cut by get_embeddings, they are cut here like the stored ones
+    embedded = normalize(np.array(get_provider().embed(queries), dtype=np.float32)[:, :full])
+    truth = top_k(products, embedded, k)
+
+    print(f"{'storage':>8} {'dim':>5} {'bytes':>6} {f'recall@{k}':>9}")
+    for dim in sorted({int(d) for d in args.dims.split(",") if int(d) <= full} | {full}, reverse=True):
+        for storage, dtype in DTYPES.items():
+            found = top_k(reduce(products, dim, storage), reduce(embedded, dim, storage), k)
+            size = dim * np.dtype(dtype).itemsize + 8
+            print(f"{storage:>8} {dim:5d} {size:6d} {recall(found, truth):9.3f}")
+
+
+if __name__ == "__main__":
+    main()
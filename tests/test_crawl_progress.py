@@ -0,0 +1,88 @@
+import asyncio
+from datetime import UTC, datetime, timedelta
+
+import httpx
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+
+from app.checkpoint import start_run
+from app.config import settings
+from app.crawler.client import ArbuzClient
+from app.crawler.limiter import RateLimiter
+from app.crawler.pipeline import CategoryJob, ProductPipeline
+from app.db.models import Category, CrawlKind, CrawlRun, CrawlStatus
+
+
+def test_job_counts_pages_without_gaps():
+    job = CategoryJob(Category(id=1, name="Молоко"))
+    job.pages = 3
+    job.page_written(2)
+    job.page_written(3)
+    assert job.last_page == 0
+    job.page_written(1)
+    assert job.last_page == 3
+    assert not job.done
+    job.fetched = True
+    assert job.done
+
+
+def test_category_ends_on_404_after_some_pages():
+    limit = settings.crawl_page_size
+
+    def handler(request):
+        if request.url.params["page"] == "1":
+            products = {"count": 3 * limit, "data": [{}] * limit}
+            return httpx.Response(200, json={"data": {"products": products}})
+        return httpx.Response(404, json={"message": "Not Found"})
+
+    async def run():
+        http = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        pipeline = ProductPipeline(ArbuzClient(http, RateLimiter(float("inf")), max_retries=0), run_id=1)
+        await pipeline.fetch_category(Category(id=1, name="Молоко", product_count=None))
+        return [pipeline.raw.get_nowait() for _ in range(pipeline.raw.qsize())], pipeline
+
+    pages, pipeline = asyncio.run(run())
+    assert [page.number for page in pages] == [1, None]
+    (job,) = pipeline.account(pages)
+    assert job.done
+    assert job.last_page == 1
+
+
+def test_pages_in_flight_are_sent_before_the_end_of_a_category():
+    limit = settings.crawl_page_size
+
+    async def handler(request):
+        page = request.url.params["page"]
+        if page == "2":
+            # still in flight when the next one fails
+            await asyncio.sleep(0.05)
+        if page in ("1", "2"):
+            products = {"count": 4 * limit, "data": [{}] * limit}
+            return httpx.Response(200, json={"data": {"products": products}})
+        return httpx.Response(404, json={"message": "Not Found"})
+
+    async def run():
+        http = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        pipeline = ProductPipeline(ArbuzClient(http, RateLimiter(float("inf")), max_retries=0), run_id=1)
+        await pipeline.fetch_category(Category(id=1, name="Молоко", product_count=None))
+        return [pipeline.raw.get_nowait() for _ in range(pipeline.raw.qsize())], pipeline
+
+    pages, pipeline = asyncio.run(run())
+    assert [page.number for page in pages] == [1, 2, None]
+    (job,) = pipeline.account(pages)
+    assert job.done
+    assert job.last_page == 2
+
+
+def test_stale_runs_are_not_resumed():
+    engine = create_engine("sqlite://")
+    CrawlRun.__table__.create(engine)
+    with Session(engine) as s:
+        old = CrawlRun(kind=CrawlKind.products, started_at=datetime.now(UTC) - timedelta(days=3))
+        recent = CrawlRun(kind=CrawlKind.products, started_at=datetime.now(UTC) - timedelta(hours=1))
+        s.add_all([old, recent])
+        s.commit()
+        assert start_run(s, CrawlKind.products).id == recent.id
+        recent.status = CrawlStatus.finished
+        s.commit()
+        assert start_run(s, CrawlKind.products).id not in (old.id, recent.id)
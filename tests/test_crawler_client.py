@@ -0,0 +1,82 @@
+import asyncio
+import math
+import time
+
+import httpx
+import pytest
+
+from app.crawler.client import ArbuzClient
+from app.crawler.limiter import RateLimiter
+
+
+def client_of(handler, limiter: RateLimiter | None = None, max_retries: int = 3) -> ArbuzClient:
+    http = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    return ArbuzClient(http, limiter or RateLimiter(math.inf), max_retries=max_retries, backoff_factor=0)
+
+
+def test_limiter_counts_tokens():
+    async def run():
+        limiter = RateLimiter(20, burst=1)
+        started = time.monotonic()
+        for _ in range(3):
+            async with limiter:
+                pass
+        return time.monotonic() - started
+
+    # the first token is there, the other two take 1/20s each
+    assert asyncio.run(run()) >= 0.09
+
+
+def test_limiter_backoff_pauses_unlimited_rate():
+    async def run():
+        limiter = RateLimiter(math.inf)
+        limiter.backoff(0.2)
+        started = time.monotonic()
+        async with limiter:
+            pass
+        return limiter.rate, time.monotonic() - started
+
+    rate, elapsed = asyncio.run(run())
+    assert rate == math.inf
+    assert elapsed >= 0.19
+
+
+def test_limiter_recovers_rate():
+    limiter = RateLimiter(10)
+    limiter.backoff(0)
+    assert limiter.rate == 5
+    for _ in range(10):
+        limiter.recover()
+    assert limiter.rate == 10
+
+
+def test_client_retries_statuses():
+    statuses = iter([429, 503, 200])
+
+    def handler(_request):
+        return httpx.Response(next(statuses), headers={"Retry-After": "0"})
+
+    rs = asyncio.run(client_of(handler).get("https://arbuz.kz/api/v1/shop/catalog/1"))
+    assert rs.status_code == 200
+
+
+def test_client_retries_network_errors():
+    calls = []
+
+    def handler(request):
+        calls.append(request)
+        if len(calls) < 3:
+            raise httpx.ConnectTimeout("timed out", request=request)
+        return httpx.Response(200)
+
+    rs = asyncio.run(client_of(handler).get("https://arbuz.kz/api/v1/shop/catalog/1"))
+    assert rs.status_code == 200
+    assert len(calls) == 3
+
+
+def test_client_raises_network_errors_after_retries():
+    def handler(request):
+        raise httpx.ConnectError("connection refused", request=request)
+
+    with pytest.raises(httpx.ConnectError):
+        asyncio.run(client_of(handler, max_retries=2).get("https://arbuz.kz/api/v1/shop/catalog/1"))
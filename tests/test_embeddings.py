@@ -0,0 +1,75 @@
+import pytest
+
+from app.gpt import embeddings, providers
+from app.gpt.providers import FakeProvider
+
+
+def test_vectors_are_cut_to_the_dimension(monkeypatch):
+    monkeypatch.setattr(embeddings, "get_provider", lambda: FakeProvider(3072))
+    [vector] = embeddings.get_embeddings(["молоко"])
+    assert len(vector) == 1536
+    assert sum(x * x for x in vector) == pytest.approx(1)
+
+
+def test_provider_of_shorter_vectors_than_the_dimension_fails(monkeypatch):
+    monkeypatch.setattr(providers, "make_provider", lambda: FakeProvider(384))
+    with pytest.raises(ValueError, match="384 dimensions"):
+        providers.get_provider.__wrapped__()
+
+
+def test_query_vectors_come_from_memory_after_the_first_request(monkeypatch):
+    stored = {}
+    monkeypatch.setattr(embeddings, "query_cache", embeddings.QueryCache(100))
+    monkeypatch.setattr(embeddings, "load_query_embeddings", lambda _model, _texts: dict(stored))
+    monkeypatch.setattr(embeddings, "store_query_embeddings", lambda _model, vectors: stored.update(vectors))
+    first = embeddings.get_query_embeddings(["Молоко", "кефир"])
+    assert embeddings.get_query_embeddings(["молоко ", "Кефир"]) == first
+    stats = embeddings.query_cache.stats()
+    assert (stats["provider"], stats["memory"], stats["hit_rate"]) == (2, 2, 0.5)
+    # the second call needed no request
+    assert embeddings.query_cache.saved_seconds == embeddings.query_cache.request_seconds > 0
+
+
+def test_query_vectors_from_the_database_save_the_request_less_the_lookup(monkeypatch, tmp_path):
+    now = [0.0]
+    monkeypatch.setattr(embeddings.time, "perf_counter", lambda: now[0])
+    monkeypatch.setattr(embeddings.time, "monotonic", lambda: now[0])
+    monkeypatch.setattr(embeddings.settings, "query_cache_prometheus_file", tmp_path / "search.prom")
+    monkeypatch.setattr(embeddings, "query_cache", embeddings.QueryCache(100))
+    embeddings.query_cache.observe_request(0.5)
+
+    def load(_model, texts):
+        now[0] += 0.125
+        return dict.fromkeys(texts, [1.0])
+
+    monkeypatch.setattr(embeddings, "load_query_embeddings", load)
+    embeddings.get_query_embeddings(["молоко"])
+    assert embeddings.query_cache.stats() == {
+        "database": 1,
+        "hit_rate": 1,
+        "saved_seconds": 0.375,
+        "lookup_seconds": 0.125,
+    }
+    exported = (tmp_path / "search.prom").read_text()
+    assert 'arbuz_search_query_embeddings_total{source="database"} 1' in exported
+    assert "arbuz_search_query_embedding_saved_seconds_total 0.375" in exported
+
+
+def test_token_batches_respect_both_limits():
+    # estimated at 40 tokens, but one of 200
+    texts = [(i, "ж" * (39 if tokens == 40 else 199)) for i, tokens in enumerate([40, 40, 40, 200, 40, 40, 40, 40])]
+    batches = list(embeddings.token_batches(texts, max_tokens=150, max_size=2))
+    assert [[i for i, _ in items] for items in batches] == [[0, 1], [2], [3], [4, 5], [6, 7]]
+    # a text longer than the limit gets a batch of its own instead of being dropped
+    assert sum(len(items) for items in batches) == len(texts)
+
+
+def test_minute_budget_waits_for_tokens(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr(embeddings.time, "monotonic", lambda: now[0])
+    monkeypatch.setattr(embeddings.time, "sleep", lambda seconds: now.__setitem__(0, now[0] + seconds))
+    budget = embeddings.MinuteBudget(rpm=60, tpm=600)
+    budget.acquire(600)
+    budget.acquire(300)
+    # half of the tokens per minute come back in half a minute
+    assert now[0] == pytest.approx(30)
@@ -0,0 +1,11 @@
+from app.metrics import Metrics
+
+
+def test_run_id_stays_out_of_the_prometheus_labels():
+    metrics = Metrics()
+    metrics.reset(kind="products", run_id=42)
+    metrics.info["status"] = "finished"
+    exposition = metrics.to_prometheus()
+    assert 'arbuz_loader_run_duration_seconds{kind="products",status="finished"} ' in exposition
+    assert "run_id" not in exposition
+    assert metrics.report()["run_id"] == 42
@@ -0,0 +1,26 @@
+import random
+
+from app.crawler.prices import price_hash
+from app.loader import product_hash
+from app.schemas.product import ProductPriceSchema, ProductSchema
+from benchmarks.parse_catalog import synthetic_product
+
+
+def schema(data: dict, sort_pos: int = 1, catalog_id: int = 1) -> ProductSchema:
+    return ProductSchema.model_validate({**data, "sortPos": sort_pos, "catalogId": catalog_id})
+
+
+def test_price_refresh_keeps_the_hash_of_a_full_load():
+    data = synthetic_product(random.Random(1), 1)
+    before = product_hash(schema(data))
+    repriced = {**data, "priceActual": data["priceActual"] + 100, "isAvailable": not data["isAvailable"]}
+    after = product_hash(schema(repriced))
+    assert before != after
+    # what apply_prices writes: the content part stays, the price part is replaced
+    content = before.split(":")[0]
+    assert f"{content}:{price_hash(ProductPriceSchema.model_validate(repriced))}" == after
+
+
+def test_hash_ignores_category_position():
+    data = synthetic_product(random.Random(2), 2)
+    assert product_hash(schema(data)) == product_hash(schema(data, sort_pos=17, catalog_id=7))
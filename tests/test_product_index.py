@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+
+from app.gpt.product_index import ProductIndex, normalize, quantize
+
+
+def index(ids, vectors, available=None, quantized=False) -> ProductIndex:
+    result = ProductIndex(quantized=quantized)
+    available = np.ones(len(ids), dtype=bool) if available is None else np.asarray(available)
+    result.merge(np.asarray(ids, dtype=np.int64), normalize(np.asarray(vectors, dtype=np.float32)), available)
+    if quantized:
+        result.codes, result.scales = quantize(result.vectors)
+    return result
+
+
+def test_merge_updates_known_ids_and_keeps_them_sorted():
+    products = index([2, 5], [[1, 0], [0, 1]])
+    products.merge(np.array([1, 5, 9]), np.array([[1, 1], [1, 0], [0, 1]], dtype=np.float32), np.array([1, 0, 1], bool))
+    assert products.ids.tolist() == [1, 2, 5, 9]
+    assert products.vectors[2].tolist() == [1, 0]
+    assert products.available.tolist() == [True, True, False, True]
+
+
+def test_remove_drops_deleted_embeddings():
+    products = index([1, 2, 3], [[1, 0], [0, 1], [1, 1]])
+    assert products.remove(np.array([1, 3, 4])) == 1
+    assert products.ids.tolist() == [1, 3]
+    assert products.remove(np.array([1, 3])) == 0
+
+
+def test_search_skips_unavailable_products():
+    products = index([1, 2, 3], [[1, 0], [0.9, 0.1], [0, 1]], available=[False, True, True])
+    [result] = products.search([[1, 0]], 2)
+    assert [product_id for product_id, _ in result] == [2, 3]
+    assert result[0][1] == pytest.approx(1 - 0.9 / np.hypot(0.9, 0.1))
+
+
+@pytest.mark.parametrize("dimension", [8, 256])
+def test_quantized_search_is_exact(dimension):
+    rnd = np.random.default_rng(dimension)
+    # clustered, so many products are close to each other and to the queries
+    centers = rnd.normal(size=(10, dimension))
+    vectors = centers[rnd.integers(10, size=2000)] + rnd.normal(scale=0.1, size=(2000, dimension))
+    ids = np.arange(1, 2001)
+    available = rnd.random(2000) > 0.1
+    queries = (centers[rnd.integers(10, size=20)] + rnd.normal(scale=0.1, size=(20, dimension))).tolist()
+    exact = index(ids, vectors, available).search(queries, 20)
+    quantized = index(ids, vectors, available, quantized=True).search(queries, 20)
+    for exact_result, quantized_result in zip(exact, quantized, strict=True):
+        # near ties may swap, float32 sums of the two differ in the last digits
+        assert {product_id for product_id, _ in quantized_result} == {product_id for product_id, _ in exact_result}
+        assert [d for _, d in quantized_result] == pytest.approx([d for _, d in exact_result], abs=1e-5)
@@ -0,0 +1,21 @@
+from app.db.models import Category, Feature, Product, ProductCategory
+
+
+def product(positions: dict[str, int], features: list[str]) -> Product:
+    return Product(
+        id=1,
+        name="Молоко 3.2%",
+        brand_name="Простоквашино",
+        product_categories=[
+            ProductCategory(category=Category(id=i, name=path, path=path), sort_pos=position)
+            for i, (path, position) in enumerate(positions.items())
+        ],
+        features=[Feature(id=i, name=name) for i, name in enumerate(features)],
+    )
+
+
+def test_text_doesnt_depend_on_positions_or_order():
+    text = product({"Молочка > Молоко": 3, "Акции": 10}, ["Без лактозы", "Фермерское"]).text_embedding()
+    again = product({"Акции": 1, "Молочка > Молоко": 42}, ["Фермерское", "Без лактозы"]).text_embedding()
+    assert text == again
+    assert "Молочка > Молоко" in text
@@ -0,0 +1,20 @@
+import pytest
+
+pytest.importorskip("marvin")
+
+from app.gpt.productologist import fuse  # noqa: E402
+
+
+def test_fuse_prefers_products_found_both_ways():
+    vector = [(1, 0.1), (2, 0.2), (3, 0.3)]
+    lexical = [(4, 0.9), (3, 0.8)]
+    assert [product_id for product_id, _ in fuse(vector, lexical)] == [3, 1, 4, 2]
+
+
+def test_fuse_breaks_ties_by_id():
+    assert [product_id for product_id, _ in fuse([(7, 0.1)], [(5, 0.9)])] == [5, 7]
+
+
+def test_fuse_scores_by_rank_only():
+    [(product_id, score)] = fuse([(1, 123.0)], k=10)
+    assert (product_id, score) == (1, pytest.approx(1 / 11))
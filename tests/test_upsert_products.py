@@ -0,0 +1,53 @@
+import random
+
+from app.loader import ImportRegistry, upsert_products
+from app.schemas.product import ProductSchema
+from benchmarks.parse_catalog import synthetic_product
+
+
+def schema(data: dict, sort_pos: int) -> ProductSchema:
+    return ProductSchema.model_validate({**data, "sortPos": sort_pos, "catalogId": 1})
+
+
+class RecordingSession:
+    """Takes the statements of `upsert_products` instead of a database, with their parameters by table."""
+
+    def __init__(self):
+        self.rows: dict[str, list[dict]] = {}
+
+    def execute(self, statement, params=None):
+        table = getattr(statement, "table", None)
+        if table is not None:
+            self.rows[table.name] = params
+        return self
+
+    def all(self):
+        return []
+
+    rowcount = 0
+
+
+def test_product_listed_on_two_pages_of_a_category_is_linked_once():
+    rnd = random.Random(3)
+    products = {product_id: synthetic_product(rnd, product_id) for product_id in (1, 2, 3)}
+    first_page = [schema(products[1], 0), schema(products[2], 1)]
+    # the listing shifted, the second product moved to the next page
+    second_page = [schema(products[2], 2), schema(products[3], 3)]
+    s = RecordingSession()
+    stats, _written = upsert_products(s, first_page + second_page, ImportRegistry())
+    assert stats.inserted == {1, 2, 3}
+    links = sorted((row["product_id"], row["category_id"], row["sort_pos"]) for row in s.rows["product_category"])
+    # a statement can't touch a row twice, the latest occurrence wins
+    assert links == [(1, 1, 0), (2, 1, 2), (3, 1, 3)]
+    assert [row["id"] for row in s.rows["product"]] == [1, 2, 3]
+
+
+def test_registry_is_left_to_the_caller_until_the_write_commits():
+    rnd = random.Random(4)
+    registry = ImportRegistry()
+    stats, written = upsert_products(RecordingSession(), [schema(synthetic_product(rnd, 1), 0)], registry)
+    assert stats.inserted == {1}
+    # a rollback would leave the product out of the database but in the registry, skipped by later pages
+    assert registry.product_hashes == {}
+    registry.update(written)
+    assert set(registry.product_hashes) == {1}